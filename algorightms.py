@@ -1,65 +1,138 @@
-from stable_baselines3 import DQN, PPO
 import typing
-from sb3_contrib import TRPO
-from sb3_contrib.qrdqn import QRDQN
-from sb3_contrib.ppo_recurrent import RecurrentPPO
-from stable_baselines3.common.buffers import ReplayBuffer
-from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+import importlib
 from collections import namedtuple
 
+if typing.TYPE_CHECKING:
+    from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
 Algorithm = namedtuple("algorithm", ['create', 'load'])
 
+# algorithm classes are imported on first use so that picking a model does not import every library
+algorithm_classes = {"DQN": ("stable_baselines3", "DQN"),
+                     "PPO": ("stable_baselines3", "PPO"),
+                     "QRDQN": ("sb3_contrib.qrdqn", "QRDQN"),
+                     "TRPO": ("sb3_contrib", "TRPO"),
+                     "RPPO": ("sb3_contrib.ppo_recurrent", "RecurrentPPO"),
+                     "PrioritizedDQN": ("prioritized", "PrioritizedDQN"),
+                     "PrioritizedQRDQN": ("prioritized", "PrioritizedQRDQN")}
+
+# off-policy algorithms that update the priorities of a "prioritized" replay buffer
+prioritized_algorithms = {"DQN": "PrioritizedDQN",
+                          "QRDQN": "PrioritizedQRDQN"}
+
+
+def algorithm_class(name: str) -> type:
+    module_name, class_name = algorithm_classes[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def lazy_load(name: str) -> typing.Callable:
+    def load(*args, replay_buffer: str = "default", **kwargs):
+        if replay_buffer == "prioritized":
+            return algorithm_class(prioritized_algorithms.get(name, name)).load(*args, **kwargs)
+        return algorithm_class(name).load(*args, **kwargs)
+    return load
+
+
+def replay_buffer_arguments(replay_buffer: str,
+                            replay_buffer_kwargs: typing.Optional[dict] = None) -> typing.Dict[str, typing.Any]:
+    """
+    Off-policy constructor arguments for the "replay_buffer" model config key:
+    "default" stores float32 observations twice per transition, "compact" uses CompactReplayBuffer
+    and "prioritized" PrioritizedReplayBuffer. The "replay_buffer_kwargs" config key is passed to the buffer,
+    e.g. {"alpha": 0.6, "beta": 0.4} for the prioritized buffer.
+    """
+    from stable_baselines3.common.buffers import ReplayBuffer
+    if replay_buffer == "default":
+        arguments = {"replay_buffer_class": ReplayBuffer,
+                     "replay_buffer_kwargs": {}}
+    elif replay_buffer == "compact":
+        from replay_buffers import CompactReplayBuffer
+        arguments = {"replay_buffer_class": CompactReplayBuffer,
+                     "optimize_memory_usage": True,
+                     "replay_buffer_kwargs": {"handle_timeout_termination": False}}
+    elif replay_buffer == "prioritized":
+        from replay_buffers import PrioritizedReplayBuffer
+        arguments = {"replay_buffer_class": PrioritizedReplayBuffer,
+                     "replay_buffer_kwargs": {}}
+    else:
+        raise ValueError(f"Unknown replay_buffer '{replay_buffer}', expected default, compact or prioritized")
+    if replay_buffer_kwargs:
+        arguments["replay_buffer_kwargs"].update(replay_buffer_kwargs)
+    return arguments
+
+
+def off_policy_class(name: str, replay_buffer: str) -> type:
+    if replay_buffer == "prioritized":
+        return algorithm_class(prioritized_algorithms[name])
+    return algorithm_class(name)
 
-def DQN_create(environment: VecEnv,
+
+def DQN_create(environment: "VecEnv",
                training_steps: int,
                network_architecture: typing.List[int],
                learning_rate: float,
                batch_size: int,
                learning_starts: int,
                tensorboard_log: str,
+               replay_buffer: str = "default",
+               buffer_size: typing.Optional[int] = None,
+               replay_buffer_kwargs: typing.Optional[dict] = None,
                **kwargs: typing.Any):
-    return DQN("MlpPolicy",
-               environment,
-               verbose=1,
-               batch_size=batch_size,
-               learning_rate=learning_rate,
-               train_freq=(1, "step"),
-               buffer_size=training_steps,
-               learning_starts=learning_starts,
-               replay_buffer_class=ReplayBuffer,
-               policy_kwargs={"net_arch": network_architecture},
-               tensorboard_log=tensorboard_log
-               )
+    from replay_buffers import report_replay_buffer
+    DQN = off_policy_class("DQN", replay_buffer)
+    model = DQN("MlpPolicy",
+                environment,
+                verbose=1,
+                batch_size=batch_size,
+                learning_rate=learning_rate,
+                train_freq=(1, "step"),
+                buffer_size=buffer_size if buffer_size else training_steps,
+                learning_starts=learning_starts,
+                policy_kwargs={"net_arch": network_architecture},
+                tensorboard_log=tensorboard_log,
+                **replay_buffer_arguments(replay_buffer, replay_buffer_kwargs)
+                )
+    report_replay_buffer(model.replay_buffer)
+    return model
 
 
-def QRDQN_create(environment: VecEnv,
+def QRDQN_create(environment: "VecEnv",
                  training_steps: int,
                  network_architecture: typing.List[int],
                  learning_rate: float,
                  batch_size: int,
                  learning_starts: int,
                  tensorboard_log: str,
+                 replay_buffer: str = "default",
+                 buffer_size: typing.Optional[int] = None,
+                 replay_buffer_kwargs: typing.Optional[dict] = None,
                  **kwargs: typing.Any):
-    return QRDQN("MlpPolicy",
-                 environment,
-                 verbose=1,
-                 batch_size=batch_size,
-                 learning_rate=learning_rate,
-                 train_freq=(1, "step"),
-                 buffer_size=training_steps,
-                 learning_starts=learning_starts,
-                 replay_buffer_class=ReplayBuffer,
-                 policy_kwargs={"net_arch": network_architecture},
-                 tensorboard_log=tensorboard_log
+    from replay_buffers import report_replay_buffer
+    QRDQN = off_policy_class("QRDQN", replay_buffer)
+    model = QRDQN("MlpPolicy",
+                  environment,
+                  verbose=1,
+                  batch_size=batch_size,
+                  learning_rate=learning_rate,
+                  train_freq=(1, "step"),
+                  buffer_size=buffer_size if buffer_size else training_steps,
+                  learning_starts=learning_starts,
+                  policy_kwargs={"net_arch": network_architecture},
+                  tensorboard_log=tensorboard_log,
+                  **replay_buffer_arguments(replay_buffer, replay_buffer_kwargs)
     )
+    report_replay_buffer(model.replay_buffer)
+    return model
 
 
-def PPO_create(environment: VecEnv,
+def PPO_create(environment: "VecEnv",
                network_architecture: typing.List[int],
                learning_rate: float,
                n_steps: int,
                tensorboard_log: str,
                **kwargs: typing.Any):
+    from stable_baselines3 import PPO
     return PPO("MlpPolicy",
                environment,
                learning_rate=learning_rate,
@@ -69,13 +142,14 @@ def PPO_create(environment: VecEnv,
                tensorboard_log=tensorboard_log)
 
 
-def RPPO_create(environment: VecEnv,
+def RPPO_create(environment: "VecEnv",
                 network_architecture: typing.List[int],
                 learning_rate: float,
                 batch_size: int,
                 n_steps: int,
                 tensorboard_log: str,
                 **kwargs: typing.Any):
+    from sb3_contrib.ppo_recurrent import RecurrentPPO
     return RecurrentPPO("MlpLstmPolicy",
                         environment,
                         batch_size=batch_size,
@@ -86,11 +160,12 @@ def RPPO_create(environment: VecEnv,
                         tensorboard_log=tensorboard_log)
 
 
-def TRPO_create(environment: VecEnv,
+def TRPO_create(environment: "VecEnv",
                 network_architecture: typing.List[int],
                 learning_rate: float,
                 tensorboard_log: str,
                 **kwargs: typing.Any):
+    from sb3_contrib import TRPO
     return TRPO("MlpPolicy",
                 environment,
                 verbose=1,
@@ -99,8 +174,8 @@ def TRPO_create(environment: VecEnv,
                 tensorboard_log=tensorboard_log)
 
 
-algorithms = {"DQN": Algorithm(DQN_create, DQN.load),
-              "PPO": Algorithm(PPO_create, PPO.load),
-              "QRDQN": Algorithm(QRDQN_create, QRDQN.load),
-              "TRPO": Algorithm(TRPO_create, TRPO.load),
-              "RPPO": Algorithm(RPPO_create, RecurrentPPO.load)}
+algorithms = {"DQN": Algorithm(DQN_create, lazy_load("DQN")),
+              "PPO": Algorithm(PPO_create, lazy_load("PPO")),
+              "QRDQN": Algorithm(QRDQN_create, lazy_load("QRDQN")),
+              "TRPO": Algorithm(TRPO_create, lazy_load("TRPO")),
+              "RPPO": Algorithm(RPPO_create, lazy_load("RPPO"))}
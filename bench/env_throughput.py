@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import typing
+import argparse
+import subprocess
+import importlib.util
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(repository_folder)
+
+# name: (task folder, env factory in tasks/<task>/env.py, factory arguments)
+cases = {"botevade": ("botevade", "create_env", {"use_lppos": False, "use_predator": True}),
+         "botevade_lppos": ("botevade", "create_env", {"use_lppos": True, "use_predator": True}),
+         "botevade_shared": ("botevade", "create_env", {"use_lppos": False, "use_predator": True, "share_world_assets": True}),
+         "tlppo": ("tlppo", "create_env", {"use_lppos": False, "use_predator": True}),
+         "oasis": ("oasis", "create_oasis_env", {"use_lppos": False, "use_predator": True}),
+         "dualevade": ("dualevade", "create_env", {"use_lppos": False, "use_predator": True})}
+for condition in range(6):
+    cases[f"botevadebelief_c{condition}"] = ("botevadebelief", "create_env", {"use_lppos": False, "use_predator": True, "condition": condition})
+cases["botevadebelief_c5_table"] = ("botevadebelief", "create_env", {"use_lppos": False, "use_predator": True, "condition": 5, "use_visibility_table": True})
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI env benchmark: measures steps/sec, reset latency and memory of the task environments')
+    parser.add_argument('-c', '--cases', type=str, help=f'comma separated cases (default all): {",".join(cases)}', required=False)
+    parser.add_argument('-s', '--steps', type=int, default=2000, help='steps per measurement (default 2000)')
+    parser.add_argument('-rs', '--resets', type=int, default=20, help='resets measured for the reset latency (default 20)')
+    parser.add_argument('-v', '--vec_sizes', type=str, default="1,4,8", help='comma separated vec env sizes (default 1,4,8)')
+    parser.add_argument('-b', '--backends', type=str, default="dummy", help='comma separated vec env backends (default dummy)')
+    parser.add_argument('-o', '--output_file', type=str, help='writes the results to a JSON file', required=False)
+    parser.add_argument('--run_case', type=str, help=argparse.SUPPRESS, required=False)
+    args = parser.parse_args()
+    return args
+
+
+def load_env_module(task_name: str):
+    # every task has its own env.py, load them under distinct module names
+    path = os.path.join(repository_folder, "tasks", task_name, "env.py")
+    spec = importlib.util.spec_from_file_location(f"{task_name}_env", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def resident_memory() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure_env(env_fn: typing.Callable, steps: int, resets: int) -> dict:
+    memory_before = resident_memory()
+    start = time.perf_counter()
+    env = env_fn()
+    creation_time = time.perf_counter() - start
+    env.reset(seed=0)
+    memory = resident_memory() - memory_before
+
+    start = time.perf_counter()
+    for _ in range(resets):
+        env.reset()
+    reset_latency = (time.perf_counter() - start) / resets
+
+    env.action_space.seed(0)
+    actions = [env.action_space.sample() for _ in range(steps)]
+    episodes = 0
+    start = time.perf_counter()
+    for action in actions:
+        _, _, terminated, truncated, _ = env.step(action)
+        if terminated or truncated:
+            episodes += 1
+            env.reset()
+    elapsed = time.perf_counter() - start
+    env.close()
+    return {"vec_size": 0,
+            "steps_per_second": steps / elapsed,
+            "reset_latency": reset_latency,
+            "creation_time": creation_time,
+            "memory_per_env": memory,
+            "episodes": episodes}
+
+
+def measure_vec_env(env_fn: typing.Callable, vec_size: int, backend: str, steps: int) -> dict:
+    import numpy as np
+    import vec_env_backends
+    memory_before = resident_memory()
+    vec_env = vec_env_backends.create_vec_env([env_fn for _ in range(vec_size)], vec_env_backend=backend)
+    start = time.perf_counter()
+    vec_env.reset()
+    reset_latency = time.perf_counter() - start
+    # worker processes are not counted in this process memory
+    memory = (resident_memory() - memory_before) / vec_size if backend == "dummy" else None
+
+    vec_env.action_space.seed(0)
+    vec_steps = max(steps // vec_size, 1)
+    actions = [np.array([vec_env.action_space.sample() for _ in range(vec_size)]) for _ in range(vec_steps)]
+    start = time.perf_counter()
+    for action in actions:
+        vec_env.step(action)
+    elapsed = time.perf_counter() - start
+    vec_env.close()
+    return {"vec_size": vec_size,
+            "backend": backend,
+            "steps_per_second": vec_steps * vec_size / elapsed,
+            "reset_latency": reset_latency,
+            "memory_per_env": memory}
+
+
+def run_case(case: str, args: argparse.Namespace) -> typing.List[dict]:
+    task_name, factory_name, factory_arguments = cases[case]
+    factory = getattr(load_env_module(task_name), factory_name)
+
+    def env_fn():
+        return factory(**factory_arguments)
+
+    results = [dict(measure_env(env_fn, args.steps, args.resets), backend="single")]
+    for backend in args.backends.split(","):
+        for vec_size in [int(vec_size) for vec_size in args.vec_sizes.split(",")]:
+            results.append(measure_vec_env(env_fn, vec_size, backend, args.steps))
+    return results
+
+
+def git_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              cwd=repository_folder,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args)))
+        exit(0)
+
+    selected_cases = args.cases.split(",") if args.cases else list(cases)
+    for case in selected_cases:
+        if case not in cases:
+            print(f"Unknown case '{case}', expected one of {list(cases)}")
+            exit(1)
+
+    report = {"commit": git_commit(),
+              "python": sys.version,
+              "steps": args.steps,
+              "results": {}}
+    forwarded_arguments = ["-s", str(args.steps), "-rs", str(args.resets), "-v", args.vec_sizes, "-b", args.backends]
+    for case in selected_cases:
+        # each case runs in a fresh process so memory and caches of the previous cases do not leak in
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run_case", case] + forwarded_arguments,
+                                 capture_output=True,
+                                 text=True)
+        if process.returncode != 0:
+            print(f"{case}: failed\n{process.stderr.strip()}")
+            report["results"][case] = {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"}
+            continue
+        results = json.loads(process.stdout.strip().splitlines()[-1])
+        report["results"][case] = results
+        for result in results:
+            memory = "-" if result["memory_per_env"] is None else f"{result['memory_per_env'] / 2 ** 20:.1f}MB"
+            print(f"{case:<18} {result['backend']:<8} n={result['vec_size']:<3} "
+                  f"{result['steps_per_second']:>10.1f} steps/s  reset {result['reset_latency'] * 1000:.2f}ms  memory {memory}")
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump(report, f, indent=2)
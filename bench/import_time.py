@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+entry_points = ["tasks/botevade/train.py",
+                "tasks/botevade/show.py",
+                "tasks/botevade/replay.py",
+                "tasks/botevade/evaluate.py",
+                "tasks/botevadebelief/train.py",
+                "tasks/botevadebelief/show.py",
+                "tasks/tlppo/train.py",
+                "tasks/dualevade/train.py",
+                "tasks/dualevade/show.py",
+                "tasks/dualevade/evaluate.py",
+                "tasks/dualevade/tsne.py"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI import time benchmark: measures the startup time of the entry points running --help')
+    parser.add_argument('-n', '--runs', type=int, default=5, help='runs per entry point, the fastest one is reported (default 5)')
+    parser.add_argument('-m', '--max_seconds', type=float, help='fails when any entry point takes longer than this', required=False)
+    parser.add_argument('-o', '--output_file', type=str, help='writes the results to a JSON file', required=False)
+    args = parser.parse_args()
+    return args
+
+
+def startup_time(script: str, runs: int) -> float:
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([repository_folder, environment.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+    script_path = os.path.join(repository_folder, script)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, script_path, "--help"],
+                                 cwd=os.path.dirname(script_path),
+                                 env=environment,
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.PIPE,
+                                 text=True)
+        times.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            raise RuntimeError(f"{script} --help failed:\n{process.stderr}")
+    return min(times)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    results = {}
+    for script in entry_points:
+        results[script] = startup_time(script, args.runs)
+        print(f"{script}: {results[script]:.3f}s")
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump({"python": sys.version, "runs": args.runs, "seconds": results}, f, indent=2)
+
+    if args.max_seconds is not None:
+        slow = [script for script, seconds in results.items() if seconds > args.max_seconds]
+        if slow:
+            print(f"entry points over {args.max_seconds}s: {', '.join(slow)}")
+            exit(1)
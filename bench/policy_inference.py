@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import typing
+import argparse
+import tempfile
+import importlib.util
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(repository_folder)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI policy inference benchmark: compares the exported numpy policies against model.predict')
+    parser.add_argument('task_name', type=str, help='task folder name (botevade, botevadebelief, dualevade, tlppo)')
+    parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
+    parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run', required=True)
+    parser.add_argument('-s', '--suffix', type=str, default="", help='data file suffix, e.g. mouse_1_best')
+    parser.add_argument('-c', '--cycle', type=int, help='model cycle')
+    parser.add_argument('-n', '--observations', type=int, default=10000, help='observations compared (default 10000)')
+    parser.add_argument('-l', '--latency_calls', type=int, default=1000, help='single observation calls timed (default 1000)')
+    parser.add_argument('-bs', '--batch_size', type=int, default=32, help='batch size of the batched calls (default 32)')
+    parser.add_argument('-ro', '--random_observations', action='store_true', help='samples the observation space instead of running the policy on the task env')
+    parser.add_argument('-o', '--output_file', type=str, help='writes the results to a JSON file', required=False)
+    args = parser.parse_args()
+    return args
+
+
+def load_env_module(task_name: str):
+    path = os.path.join(repository_folder, "tasks", task_name, "env.py")
+    spec = importlib.util.spec_from_file_location(f"{task_name}_env", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def collect_observations(task_name: str, model_config: dict, model, count: int):
+    """
+    Runs the trained policy on the task env so the policies are compared on the states they visit.
+    """
+    import numpy as np
+    env_module = load_env_module(task_name)
+    env = env_module.create_env(use_lppos=False, **model_config)
+    if hasattr(env_module, "set_other_policy"):
+        env_module.set_other_policy(vec_env=env, model=model)
+    observations = []
+    observation, _ = env.reset(seed=0)
+    while len(observations) < count:
+        observations.append(observation)
+        action, _ = model.predict(observation, deterministic=True)
+        observation, _, terminated, truncated, _ = env.step(action)
+        if terminated or truncated:
+            observation, _ = env.reset()
+    env.close()
+    return np.asarray(observations, dtype=np.float32)
+
+
+def latency(predict: typing.Callable, observations, calls: int) -> float:
+    start = time.perf_counter()
+    for index in range(calls):
+        predict(observations[index % len(observations)])
+    return (time.perf_counter() - start) / calls
+
+
+def measure(predict: typing.Callable, observations, args: argparse.Namespace) -> dict:
+    batches = [observations[index:index + args.batch_size] for index in range(0, len(observations) - args.batch_size + 1, args.batch_size)]
+    return {"single_latency": latency(predict, observations, args.latency_calls),
+            "batch_latency": latency(predict, batches, max(args.latency_calls // args.batch_size, 1))}
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    import numpy as np
+    import config
+    import inference
+    from algorightms import algorithms
+
+    run = config.RunContext(task_name=args.task_name,
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
+    with open(run.model_config_file()) as f:
+        model_config = json.load(f)
+    run_data_file = run.data_file(suffix=args.suffix)
+    if args.cycle:
+        run_data_file = run_data_file.replace(".zip", f"_{args.cycle}.zip")
+
+    model = algorithms[model_config["algorithm"]].load(run_data_file)
+    if args.random_observations:
+        model.observation_space.seed(0)
+        observations = np.asarray([model.observation_space.sample() for _ in range(args.observations)], dtype=np.float32)
+    else:
+        observations = collect_observations(args.task_name, model_config, model, args.observations)
+    reference_actions, _ = model.predict(observations, deterministic=True)
+
+    def model_predict(observation):
+        return model.predict(observation, deterministic=True)
+
+    report = {"data_file": run_data_file,
+              "observations": len(observations),
+              "batch_size": args.batch_size,
+              "results": {"model.predict": measure(model_predict, observations, args)}}
+    with tempfile.TemporaryDirectory() as folder:
+        for dtype in inference.weight_dtypes:
+            policy_file = os.path.join(folder, f"policy_{dtype}.npz")
+            numpy_policy = inference.export_policy(model, policy_file, dtype=dtype)
+            actions, _ = numpy_policy.predict(observations)
+
+            def numpy_predict(observation):
+                return numpy_policy.predict(observation, deterministic=True)
+
+            report["results"][dtype] = dict(measure(numpy_predict, observations, args),
+                                            agreement=float((actions == reference_actions).mean()),
+                                            file_size=os.path.getsize(policy_file))
+
+    for name, result in report["results"].items():
+        agreement = f"{result['agreement'] * 100:6.2f}%" if "agreement" in result else "      -"
+        size = f"{result['file_size'] / 2 ** 10:8.1f}KB" if "file_size" in result else "         -"
+        print(f"{name:<14} agreement {agreement}  size {size}  "
+              f"single {result['single_latency'] * 1e6:8.1f}us  batch of {args.batch_size} {result['batch_latency'] * 1e6:8.1f}us")
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump(report, f, indent=2)
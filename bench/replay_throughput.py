@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+repository_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(repository_folder)
+
+buffer_types = ["default", "compact", "prioritized"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI replay buffer benchmark: measures add, sample and priority update throughput')
+    parser.add_argument('-b', '--buffers', type=str, default=",".join(buffer_types), help=f'comma separated buffer types (default {",".join(buffer_types)})')
+    parser.add_argument('-s', '--buffer_size', type=int, default=1000000, help='buffer capacity in transitions (default 1000000)')
+    parser.add_argument('-n', '--n_envs', type=int, default=5, help='envs adding transitions (default 5)')
+    parser.add_argument('-os', '--observation_size', type=int, default=16, help='observation vector size (default 16)')
+    parser.add_argument('-a', '--actions', type=int, default=240, help='discrete action count (default 240)')
+    parser.add_argument('-bs', '--batch_size', type=int, default=256, help='sample batch size (default 256)')
+    parser.add_argument('-i', '--iterations', type=int, default=2000, help='sample and update iterations (default 2000)')
+    parser.add_argument('-o', '--output_file', type=str, help='writes the results to a JSON file', required=False)
+    args = parser.parse_args()
+    return args
+
+
+def create_buffer(buffer_type: str, observation_space, action_space, args: argparse.Namespace):
+    from stable_baselines3.common.buffers import ReplayBuffer
+    from replay_buffers import CompactReplayBuffer, PrioritizedReplayBuffer
+    if buffer_type == "default":
+        return ReplayBuffer(args.buffer_size, observation_space, action_space, device="cpu", n_envs=args.n_envs)
+    if buffer_type == "compact":
+        return CompactReplayBuffer(args.buffer_size, observation_space, action_space, device="cpu", n_envs=args.n_envs)
+    return PrioritizedReplayBuffer(args.buffer_size, observation_space, action_space, device="cpu", n_envs=args.n_envs)
+
+
+def measure(buffer_type: str, args: argparse.Namespace) -> dict:
+    import numpy as np
+    from gymnasium import spaces
+    from replay_buffers import PrioritizedReplayBuffer, transition_bytes
+    observation_space = spaces.Box(-1, 1, (args.observation_size,), dtype=np.float32)
+    action_space = spaces.Discrete(args.actions)
+    buffer = create_buffer(buffer_type, observation_space, action_space, args)
+    generator = np.random.default_rng(0)
+
+    # fills the whole buffer, the add rate is measured on the first steps
+    observations = generator.uniform(-1, 1, (args.n_envs, args.observation_size)).astype(np.float32)
+    actions = generator.integers(0, args.actions, size=args.n_envs)
+    rewards = generator.normal(size=args.n_envs).astype(np.float32)
+    dones = np.zeros(args.n_envs, dtype=np.float32)
+    infos = [{} for _ in range(args.n_envs)]
+    add_steps = buffer.buffer_size
+    measured_steps = min(add_steps, args.iterations * 10)
+    start = time.perf_counter()
+    for step in range(add_steps):
+        buffer.add(observations, observations, actions, rewards, dones, infos)
+        if step + 1 == measured_steps:
+            add_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        buffer.sample(args.batch_size)
+    sample_time = time.perf_counter() - start
+
+    result = {"bytes_per_transition": transition_bytes(buffer),
+              "adds_per_second": measured_steps * args.n_envs / add_time,
+              "samples_per_second": args.iterations * args.batch_size / sample_time,
+              "updates_per_second": None}
+    if isinstance(buffer, PrioritizedReplayBuffer):
+        indices = [buffer.sample(args.batch_size).indices for _ in range(args.iterations)]
+        td_errors = generator.exponential(size=(args.iterations, args.batch_size))
+        start = time.perf_counter()
+        for batch_indices, batch_td_errors in zip(indices, td_errors):
+            buffer.update_priorities(batch_indices, batch_td_errors)
+        result["updates_per_second"] = args.iterations * args.batch_size / (time.perf_counter() - start)
+    return result
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    report = {"python": sys.version,
+              "buffer_size": args.buffer_size,
+              "n_envs": args.n_envs,
+              "batch_size": args.batch_size,
+              "results": {}}
+    for buffer_type in args.buffers.split(","):
+        if buffer_type not in buffer_types:
+            print(f"Unknown buffer '{buffer_type}', expected one of {buffer_types}")
+            exit(1)
+        result = measure(buffer_type, args)
+        report["results"][buffer_type] = result
+        updates = "-" if result["updates_per_second"] is None else f"{result['updates_per_second']:.0f}"
+        print(f"{buffer_type:<12} {result['bytes_per_transition']:8.1f} bytes/transition  "
+              f"add {result['adds_per_second']:10.0f}/s  sample {result['samples_per_second']:10.0f}/s  update {updates}/s")
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -1,68 +1,239 @@
+import os
+import json
+import typing
+import numpy as np
 from stable_baselines3.common.callbacks import BaseCallback
-from stable_baselines3.common.utils import safe_mean
+
+
+class RingBuffer:
+    """
+    Fixed size window of the most recent values with a running sum,
+    appending and reading the mean are O(1).
+    """
+    def __init__(self, size: int):
+        self.values = np.zeros(max(size, 1), dtype=np.float64)
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value: float):
+        if self.count == len(self.values):
+            self.total -= self.values[self.index]
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.index += 1
+        if self.index == len(self.values):
+            self.index = 0
+            # resync once per lap so the running sum does not drift
+            self.total = float(self.values.sum())
+
+    def sum(self) -> float:
+        return self.total
+
+    def mean(self) -> float:
+        if self.count == 0:
+            return np.nan
+        return self.total / self.count
 
 
 class CellworldCallback(BaseCallback):
-    def __init__(self, verbose=0):
+    """
+    Collects cellworld episode statistics from the env infos.
+
+    :param log_frequency: push the statistics to the logger every log_frequency steps,
+        when None they are pushed once at the end of each rollout
+    :param verbose: verbosity level
+    """
+    def __init__(self, log_frequency: typing.Optional[int] = None, verbose=0):
         super(CellworldCallback, self).__init__(verbose)
+        self.log_frequency = log_frequency
+        self.pending_records = False
         self.captures_in_episode = 0
-        self.rewards = [0]
-        self.captures = [0]
-        self.captured = [0]
-        self.survival = [0]
-        self.finished = [0]
-        self.truncated = [0]
-        self.agents = {}
+        self.rewards: typing.Optional[RingBuffer] = None
+        self.captures: typing.Optional[RingBuffer] = None
+        self.captured: typing.Optional[RingBuffer] = None
+        self.survival: typing.Optional[RingBuffer] = None
+        self.finished: typing.Optional[RingBuffer] = None
+        self.truncated: typing.Optional[RingBuffer] = None
+        self.agents: typing.Dict[str, typing.Dict[str, RingBuffer]] = {}
         self.stats_windows_size = 0
         self.current_survival = 0.0
+        self.belief_time: typing.Dict[str, float] = {}
+        self.belief_steps = 0
 
     def _on_training_start(self):
+        # learn is called once per training cycle, stats carry over unless the window changes
+        if self.survival is not None and self.stats_windows_size == self.model._stats_window_size:
+            return
         self.stats_windows_size = self.model._stats_window_size
+        self.rewards = RingBuffer(self.stats_windows_size)
+        self.captures = RingBuffer(self.stats_windows_size)
+        self.captured = RingBuffer(self.stats_windows_size)
+        self.survival = RingBuffer(self.stats_windows_size)
+        self.finished = RingBuffer(self.stats_windows_size)
+        self.truncated = RingBuffer(self.stats_windows_size)
+        self.agents = {}
 
     def _on_step(self):
         for env_id, info in enumerate(self.locals["infos"]):
+            if "belief_time" in info:
+                self.belief_steps += 1
+                for component, seconds in info["belief_time"].items():
+                    self.belief_time[component] = self.belief_time.get(component, 0.0) + seconds
             if 'terminal_observation' in info:
                 self.rewards.append(info["reward"])
-                if len(self.rewards) > self.stats_windows_size:
-                    self.rewards.pop(0)
-
                 self.captures.append(info["captures"])
-                if len(self.captures) > self.stats_windows_size:
-                    self.captures.pop(0)
-
                 self.survival.append(info["survived"])
-                if len(self.survival) > self.stats_windows_size:
-                    self.survival.pop(0)
-
                 self.captured.append(1 if info["captures"] > 0 else 0)
-                if len(self.captured) > self.stats_windows_size:
-                    self.captured.pop(0)
-
                 self.finished.append(0 if info["TimeLimit.truncated"] else 1)
-                if len(self.finished) > self.stats_windows_size:
-                    self.finished.pop(0)
-
                 self.truncated.append(1 if info["TimeLimit.truncated"] else 0)
-                if len(self.truncated) > self.stats_windows_size:
-                    self.truncated.pop(0)
-                self.current_survival = safe_mean(self.survival)
-                self.logger.record('cellworld/avg_captures', safe_mean(self.captures))
-                self.logger.record('cellworld/survival_rate', self.current_survival)
-                self.logger.record('cellworld/ep_finished', sum(self.finished))
-                self.logger.record('cellworld/ep_truncated', sum(self.truncated))
-                self.logger.record('cellworld/ep_captured', sum(self.captured))
-                self.logger.record('cellworld/reward', safe_mean(self.rewards))
 
                 for agent_name, agent_stats in info["agents"].items():
                     if agent_name not in self.agents:
-                        self.agents[agent_name] = {}
+                        self.agents[agent_name] = {stat: RingBuffer(self.stats_windows_size) for stat in agent_stats}
+                    agent_windows = self.agents[agent_name]
                     for stat, value in agent_stats.items():
-                        if stat not in self.agents[agent_name]:
-                            self.agents[agent_name][stat] = []
-                        self.agents[agent_name][stat].append(value)
-                        if len(self.agents[agent_name][stat]) > self.stats_windows_size:
-                            self.agents[agent_name][stat].pop(0)
-                        stat_values = self.agents[agent_name][stat]
-                        self.logger.record('cellworld/{}_{}'.format(agent_name, stat), safe_mean(stat_values))
+                        if stat not in agent_windows:
+                            agent_windows[stat] = RingBuffer(self.stats_windows_size)
+                        agent_windows[stat].append(value)
+
+                self.current_survival = self.survival.mean()
+                self.pending_records = True
 
+        if self.log_frequency and self.n_calls % self.log_frequency == 0:
+            self._record()
         return True
+
+    def _on_rollout_end(self):
+        if not self.log_frequency:
+            self._record()
+
+    def _record(self):
+        if not self.pending_records:
+            return
+        self.logger.record('cellworld/avg_captures', self.captures.mean())
+        self.logger.record('cellworld/survival_rate', self.current_survival)
+        self.logger.record('cellworld/ep_finished', self.finished.sum())
+        self.logger.record('cellworld/ep_truncated', self.truncated.sum())
+        self.logger.record('cellworld/ep_captured', self.captured.sum())
+        self.logger.record('cellworld/reward', self.rewards.mean())
+        for agent_name, agent_windows in self.agents.items():
+            for stat, window in agent_windows.items():
+                self.logger.record('cellworld/{}_{}'.format(agent_name, stat), window.mean())
+        if self.belief_steps:
+            # cumulative seconds since training started plus the average cost of one env step
+            for component, seconds in self.belief_time.items():
+                self.logger.record('cellworld/belief_time/{}'.format(component), seconds)
+                self.logger.record('cellworld/belief_time/{}_ms_per_step'.format(component), seconds * 1000 / self.belief_steps)
+            self.logger.record('cellworld/belief_time/total', sum(self.belief_time.values()))
+        self.pending_records = False
+
+
+class SurvivalPruningCallback(BaseCallback):
+    """
+    Stops training when the survival rate of a CellworldCallback stops improving, or when it falls
+    below the median of the other trials of a sweep at the same timestep. Returning False from
+    _on_step ends model.learn, the train loop checks pruned to skip the remaining cycles.
+
+    :param cellworld_callback: callback computing the survival rate, must run before this one
+    :param check_steps: timesteps between checks
+    :param warmup_steps: timesteps before the first check
+    :param patience: checks without an improvement larger than min_delta before pruning, None disables it
+    :param min_delta: smallest survival rate increase counted as an improvement
+    :param reports_folder: folder shared by the trials of a sweep, None disables median pruning
+    :param trial_name: name of this trial report in reports_folder
+    :param min_trials: other trials that must have reached a timestep before comparing with their median
+    """
+    def __init__(self,
+                 cellworld_callback: CellworldCallback,
+                 check_steps: int = 10000,
+                 warmup_steps: int = 0,
+                 patience: typing.Optional[int] = 10,
+                 min_delta: float = 0.01,
+                 reports_folder: typing.Optional[str] = None,
+                 trial_name: str = "",
+                 min_trials: int = 3,
+                 verbose=0):
+        super(SurvivalPruningCallback, self).__init__(verbose)
+        self.cellworld_callback = cellworld_callback
+        self.check_steps = check_steps
+        self.warmup_steps = warmup_steps
+        self.patience = patience
+        self.min_delta = min_delta
+        self.reports_folder = reports_folder
+        self.trial_name = trial_name
+        self.min_trials = min_trials
+        self.best_survival = -np.inf
+        self.checks_without_improvement = 0
+        self.next_check = 0
+        self.report: typing.Dict[str, float] = {}
+        self.pruned = False
+        self.reason = ""
+
+    def _on_training_start(self):
+        if self.next_check == 0:
+            self.next_check = max(self.warmup_steps, self.check_steps)
+
+    def _on_step(self):
+        if self.num_timesteps < self.next_check:
+            return True
+        # checks land on multiples of check_steps so trials report comparable timesteps
+        checkpoint = self.num_timesteps - self.num_timesteps % self.check_steps
+        self.next_check = checkpoint + self.check_steps
+        survival = self.cellworld_callback.current_survival
+        if self.cellworld_callback.survival is None or len(self.cellworld_callback.survival) == 0:
+            return True
+
+        if survival > self.best_survival + self.min_delta:
+            self.best_survival = survival
+            self.checks_without_improvement = 0
+        else:
+            self.checks_without_improvement += 1
+        if self.patience is not None and self.checks_without_improvement >= self.patience:
+            self._prune(f"survival rate plateaued at {self.best_survival:.3f} for {self.patience} checks")
+
+        if self.reports_folder:
+            self._write_report(checkpoint, survival)
+            median = self._median_survival(checkpoint)
+            if median is not None and survival < median:
+                self._prune(f"survival rate {survival:.3f} below the sweep median {median:.3f} at {checkpoint} steps")
+
+        if self.pruned:
+            self.logger.record('cellworld/pruned_at', checkpoint)
+        return not self.pruned
+
+    def _prune(self, reason: str):
+        if not self.pruned:
+            self.pruned = True
+            self.reason = reason
+            if self.verbose > 0:
+                print(f"pruning: {reason}")
+
+    def _write_report(self, checkpoint: int, survival: float):
+        self.report[str(checkpoint)] = float(survival)
+        os.makedirs(self.reports_folder, exist_ok=True)
+        report_file = os.path.join(self.reports_folder, f"{self.trial_name}.json")
+        with open(f"{report_file}.tmp", "w") as f:
+            json.dump(self.report, f)
+        os.replace(f"{report_file}.tmp", report_file)
+
+    def _median_survival(self, checkpoint: int) -> typing.Optional[float]:
+        values = []
+        for file_name in os.listdir(self.reports_folder):
+            if not file_name.endswith(".json") or file_name == f"{self.trial_name}.json":
+                continue
+            try:
+                with open(os.path.join(self.reports_folder, file_name)) as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if str(checkpoint) in report:
+                values.append(report[str(checkpoint)])
+        if len(values) < self.min_trials:
+            return None
+        return float(np.median(values))
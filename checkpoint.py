@@ -0,0 +1,79 @@
+import io
+import os
+import queue
+import shutil
+import atexit
+import threading
+import typing
+
+
+class CheckpointWriter:
+    """
+    Writes model checkpoints on a background thread.
+
+    save serializes the model once into memory (training only waits for that), the worker
+    thread writes the bytes to the first path and hard links (or copies, when linking is not
+    possible) the remaining paths to it, so latest/best aliases are never serialized again.
+    Pending writes are flushed on close and at interpreter exit.
+    """
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue()
+        self.error: typing.Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, model, path: str, *aliases: str):
+        self._raise_error()
+        snapshot = io.BytesIO()
+        model.save(snapshot)
+        self.queue.put((snapshot.getvalue(), path, aliases))
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                data, path, aliases = job
+                write_file(path, data)
+                for alias in aliases:
+                    link_file(path, alias)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
+def write_file(path: str, data: bytes):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def link_file(source: str, destination: str):
+    temp_path = f"{destination}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
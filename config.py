@@ -2,116 +2,127 @@ import typing
 import os
 
 
-task_name = ""
-model_name = ""
-run_identifier = ""
-
-
-def set_run_identifier(run_id: typing.Optional[str]):
-    global run_identifier
-
-    if run_id:
-        run_identifier = run_id
-    else:
-        from datetime import datetime
-        current_datetime = datetime.now()
-        run_identifier = current_datetime.strftime("%Y%m%d%H%M%S")
-
-def set_task(task: str):
-    global task_name
-    task_name = task
-
-
-def set_model(model: str):
-    global model_name
-    model_name = model
-
-
-def data_folder():
-    folder = os.path.join("data", task_name, model_name, run_identifier)
-    os.makedirs(folder, exist_ok=True)
-    return folder
-
-
-def buffers_folder():
-    folder = os.path.join("buffers", task_name, model_name, run_identifier)
-    os.makedirs(folder, exist_ok=True)
-    return folder
-
-
-def experiments_folder():
-    folder = os.path.join("experiments", task_name, model_name, run_identifier)
-    os.makedirs(folder, exist_ok=True)
-    return folder
-
-
-def experiments_name():
+def new_run_identifier() -> str:
     from datetime import datetime
-    now = datetime.now().strftime("%Y%m%d_%H%M%S")
-    name = f"{now}_{task_name}_{model_name}_{run_identifier}"
-    return name
-
+    current_datetime = datetime.now()
+    return current_datetime.strftime("%Y%m%d%H%M%S")
+
+
+class RunContext:
+    """
+    Task, model and run identifier of a run, with the paths of its files.
+
+    Run folders are created the first time they are requested and memoized, so the paths
+    can be requested every cycle without touching the file system. The context only holds
+    strings and can be passed to worker processes.
+
+    :param task_name: task folder name (botevade, dualevade, ...)
+    :param model_name: name of the model configuration in models/<task_name>
+    :param run_identifier: string identifying the run, a timestamp when empty
+    :param model_configs_folder: folder of the model configuration files, models/<task_name> when empty
+    """
+    def __init__(self,
+                 task_name: str,
+                 model_name: str,
+                 run_identifier: typing.Optional[str] = None,
+                 model_configs_folder: typing.Optional[str] = None):
+        self.task_name = task_name
+        self.model_name = model_name
+        self.run_identifier = run_identifier if run_identifier else new_run_identifier()
+        self.model_configs_folder = model_configs_folder
+        self.folders: typing.Dict[typing.Tuple[str, ...], str] = {}
+
+    def with_run_identifier(self, run_identifier: typing.Optional[str]) -> "RunContext":
+        return RunContext(task_name=self.task_name,
+                          model_name=self.model_name,
+                          run_identifier=run_identifier,
+                          model_configs_folder=self.model_configs_folder)
+
+    def _folder(self, *parts: str) -> str:
+        folder = self.folders.get(parts)
+        if folder is None:
+            folder = os.path.join(*parts)
+            os.makedirs(folder, exist_ok=True)
+            self.folders[parts] = folder
+        return folder
+
+    def data_folder(self) -> str:
+        return self._folder("data", self.task_name, self.model_name, self.run_identifier)
+
+    def buffers_folder(self) -> str:
+        return self._folder("buffers", self.task_name, self.model_name, self.run_identifier)
+
+    def experiments_folder(self) -> str:
+        return self._folder("experiments", self.task_name, self.model_name, self.run_identifier)
+
+    def experiments_name(self) -> str:
+        from datetime import datetime
+        now = datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = f"{now}_{self.task_name}_{self.model_name}_{self.run_identifier}"
+        return name
 
-def models_folder():
-    return os.path.join("models", task_name)
+    def models_folder(self) -> str:
+        if self.model_configs_folder:
+            return self.model_configs_folder
+        return os.path.join("models", self.task_name)
 
+    def data_file(self, suffix: str = "", cycle: str = "") -> str:
+        name = "_".join(part for part in (self.run_identifier, suffix, cycle) if part)
+        return os.path.join(self.data_folder(), f"{name}.zip")
 
-def data_file(suffix: str = "", cycle: str = "") -> str:
-    if cycle:
+    def performance_file(self, suffix: str = "") -> str:
         if suffix:
-            return os.path.join(data_folder(), f"{run_identifier}_{suffix}_{cycle}.zip")
+            return os.path.join(self.data_folder(), f"performance_{suffix}.json")
         else:
-            return os.path.join(data_folder(), f"{run_identifier}_{cycle}.zip")
-    else:
+            return os.path.join(self.data_folder(), f"performance.json")
+
+    def out_buffer_file(self, suffix: str = "") -> str:
         if suffix:
-            return os.path.join(data_folder(), f"{run_identifier}_{suffix}.zip")
+            return os.path.join(self.buffers_folder(), f"buffer_{suffix}")
         else:
-            return os.path.join(data_folder(), f"{run_identifier}.zip")
+            return os.path.join(self.buffers_folder(), f"buffer")
 
+    def in_buffer_file(self, replay_buffer_file: str) -> str:
+        return os.path.join(self.buffers_folder(), replay_buffer_file)
 
+    def model_config_file(self) -> str:
+        return os.path.join(self.models_folder(), f"{self.model_name}_config.json")
 
-def performance_file(suffix: str = "") -> str:
-    if suffix:
-        return os.path.join(data_folder(), f"performance_{suffix}.json")
-    else:
-        return os.path.join(data_folder(), f"performance.json")
-
-
-def out_buffer_file(suffix: str = "") -> str:
-    if suffix:
-        return os.path.join(buffers_folder(), f"buffer_{suffix}.pickle")
-    else:
-        return os.path.join(buffers_folder(), f"buffer.pickle")
-
-
-def in_buffer_file(replay_buffer_file: str) -> str:
-    return os.path.join(buffers_folder(), replay_buffer_file)
-
+    def tensor_board_logs_folder(self, suffix: str = "") -> str:
+        if suffix:
+            return self._folder("tensorboard_logs", self.task_name, self.model_name, self.run_identifier, suffix)
+        else:
+            return self._folder("tensorboard_logs", self.task_name, self.model_name, self.run_identifier)
 
-def model_config_file() -> str:
-    return os.path.join(models_folder(), f"{model_name}_config.json")
+    def video_folder(self) -> str:
+        return self._folder("videos", self.task_name, self.model_name, self.run_identifier)
 
 
-def tensor_board_logs_folder(suffix: str = "") -> str:
-    if suffix:
-        folder = os.path.join("tensorboard_logs", task_name, model_name, run_identifier, suffix)
-    else:
-        folder = os.path.join("tensorboard_logs", task_name, model_name, run_identifier)
+def transitions_cache_folder() -> str:
+    folder = os.path.join("buffers", "transitions")
     os.makedirs(folder, exist_ok=True)
     return folder
 
 
-def video_folder() -> str:
-    folder = os.path.join("videos", task_name, model_name, run_identifier)
+def visibility_tables_folder() -> str:
+    folder = os.path.join("cache", "visibility")
     os.makedirs(folder, exist_ok=True)
     return folder
 
 
 if __name__ == "__main__":
-    set_task("TEST_TASK")
-    set_model("TEST_MODEL")
-    set_run_identifier("RUNID")
-    print("Data Folder:", data_folder())
-    assert (data_folder() == os.path.join("data", "TEST_TASK", "TEST_MODEL", "RUNID"))
-    print("Tensor Board Folder", tensor_board_logs_folder())
-    assert (tensor_board_logs_folder() == os.path.join("tensorboard_logs", "TEST_TASK", "TEST_MODEL_RUNID"))
+    import pickle
+    import tempfile
+    os.chdir(tempfile.mkdtemp())
+    run = RunContext(task_name="TEST_TASK", model_name="TEST_MODEL", run_identifier="RUNID")
+    print("Data Folder:", run.data_folder())
+    assert (run.data_folder() == os.path.join("data", "TEST_TASK", "TEST_MODEL", "RUNID"))
+    assert (run.data_file(suffix="mouse_1", cycle="best") == os.path.join("data", "TEST_TASK", "TEST_MODEL", "RUNID", "RUNID_mouse_1_best.zip"))
+    print("Tensor Board Folder", run.tensor_board_logs_folder())
+    assert (run.tensor_board_logs_folder() == os.path.join("tensorboard_logs", "TEST_TASK", "TEST_MODEL", "RUNID"))
+    assert (os.path.isdir(run.tensor_board_logs_folder(suffix="mouse_1")))
+    assert (pickle.loads(pickle.dumps(run)).data_file() == run.data_file())
+    assert (run.with_run_identifier("OTHER").data_file() == os.path.join("data", "TEST_TASK", "TEST_MODEL", "OTHER", "OTHER.zip"))
+    assert (run.model_config_file() == os.path.join("models", "TEST_TASK", "TEST_MODEL_config.json"))
+    sweep_run = RunContext(task_name="TEST_TASK", model_name="TEST_MODEL", run_identifier="RUNID", model_configs_folder="SWEEP")
+    assert (sweep_run.with_run_identifier("OTHER").model_config_file() == os.path.join("SWEEP", "TEST_MODEL_config.json"))
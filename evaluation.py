@@ -0,0 +1,64 @@
+import json
+import typing
+import numpy as np
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+
+def evaluate(model,
+             vec_env: VecEnv,
+             episode_count: int,
+             deterministic: bool = True) -> typing.Dict[str, typing.List[float]]:
+    """
+    Runs episode_count episodes across all the envs of vec_env with one batched predict per step.
+    Episodes are split evenly between the envs so short episodes are not over represented.
+
+    :return: per episode reward, survival, captures and length
+    """
+    env_count = vec_env.num_envs
+    episode_targets = np.array([(episode_count + env_index) // env_count for env_index in range(env_count)])
+    episode_counts = np.zeros(env_count, dtype=int)
+    episode_lengths = np.zeros(env_count, dtype=int)
+    episodes = {"reward": [], "survived": [], "captures": [], "length": []}
+
+    observations = vec_env.reset()
+    states = None
+    episode_starts = np.ones((env_count,), dtype=bool)
+    while (episode_counts < episode_targets).any():
+        actions, states = model.predict(observations,
+                                        state=states,
+                                        episode_start=episode_starts,
+                                        deterministic=deterministic)
+        observations, rewards, dones, infos = vec_env.step(actions)
+        episode_lengths += 1
+        for env_index in np.flatnonzero(dones):
+            if episode_counts[env_index] < episode_targets[env_index]:
+                info = infos[env_index]
+                episodes["reward"].append(float(info["reward"]))
+                episodes["survived"].append(float(info["survived"]))
+                episodes["captures"].append(int(info["captures"]))
+                episodes["length"].append(int(episode_lengths[env_index]))
+                episode_counts[env_index] += 1
+            episode_lengths[env_index] = 0
+        episode_starts = dones
+    return episodes
+
+
+def summarize(episodes: typing.Dict[str, typing.List[float]]) -> dict:
+    summary = {"episode_count": len(episodes["reward"])}
+    for metric, values in episodes.items():
+        values = np.asarray(values, dtype=np.float64)
+        summary[metric] = {"mean": float(values.mean()) if len(values) else None,
+                           "std": float(values.std()) if len(values) else None,
+                           "min": float(values.min()) if len(values) else None,
+                           "max": float(values.max()) if len(values) else None}
+    summary["survival_rate"] = summary["survived"]["mean"]
+    summary["capture_rate"] = float(np.mean(np.asarray(episodes["captures"]) > 0)) if episodes["captures"] else None
+    return summary
+
+
+def save_evaluation(episodes: typing.Dict[str, typing.List[float]],
+                    performance_file: str) -> dict:
+    summary = summarize(episodes)
+    with open(performance_file, 'w') as f:
+        json.dump({"summary": summary, "episodes": episodes}, f)
+    return summary
@@ -0,0 +1,348 @@
+import os
+import json
+import typing
+import hashlib
+from collections import namedtuple
+import numpy as np
+import cellworld as cw
+import cellworld_game as cwgame
+import gymnasium
+from scipy.spatial import cKDTree
+import config
+
+# bump whenever the derivation of the transitions in this file changes (observations, resampling, ...)
+transitions_format_version = 1
+
+
+def experiment_files(start_path: str) -> typing.List[str]:
+    entries = os.listdir(start_path)
+    for entry in entries:
+        full_path = os.path.join(start_path, entry)
+        if os.path.isdir(full_path):
+            experiment_file = f"{entry}_experiment.json"
+            experiment_file_path = os.path.join(full_path, experiment_file)
+            if os.path.exists(experiment_file_path):
+                yield experiment_file_path
+
+
+def trajectory_arrays(trajectory: cw.Trajectories) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    time_stamps = np.array([step.time_stamp for step in trajectory], dtype=np.float64)
+    locations = np.array([step.location.get_values() for step in trajectory], dtype=np.float64).reshape(-1, 2)
+    rotations = np.array([step.rotation for step in trajectory], dtype=np.float64)
+    return time_stamps, locations, rotations
+
+
+def cell_locator(cells: cw.Cell_group) -> cKDTree:
+    """
+    KD-tree over the cell locations, querying a location returns the index of the closest cell in the group.
+    """
+    return cKDTree(np.array([cell.location.get_values() for cell in cells], dtype=np.float64).reshape(-1, 2))
+
+
+def get_agent_states_from_episode(episode: cw.Episode,
+                                  time_step: float,
+                                  actions: cKDTree) -> typing.Tuple[cwgame.AgentState, typing.Optional[cwgame.AgentState]]:
+
+    trajectories = episode.trajectories.split_by_agent()
+
+    if "prey" not in trajectories:
+        return
+
+    prey_time_stamps, prey_locations, _ = trajectory_arrays(trajectories["prey"])
+    if len(prey_time_stamps) == 0:
+        return
+
+    # time_step grid starting at the first prey step, each tick takes the first step at or after it
+    start_time = prey_time_stamps[0]
+    tick_count = int((prey_time_stamps[-1] - start_time) / time_step) + 2
+    step_times = start_time + time_step * np.arange(1, tick_count)
+    prey_indices = np.searchsorted(prey_time_stamps, step_times, side="left")
+    tick_count = int(np.searchsorted(prey_indices, len(prey_time_stamps), side="left"))
+    if tick_count == 0:
+        return
+    step_times = step_times[:tick_count]
+    prey_tick_locations = prey_locations[prey_indices[:tick_count]]
+
+    _, tick_actions = actions.query(prey_tick_locations)
+
+    # the episode starts when the prey leaves the first cell of the group
+    moved = np.flatnonzero(tick_actions)
+    if len(moved) == 0:
+        return
+    first_tick = moved[0]
+
+    previous_locations = np.vstack([prey_locations[:1], prey_tick_locations[:-1]])
+
+    has_predator = "predator" in trajectories
+    if has_predator:
+        predator_time_stamps, predator_locations, predator_rotations = trajectory_arrays(trajectories["predator"])
+        predator_indices = np.minimum(np.searchsorted(predator_time_stamps, step_times, side="left"),
+                                      len(predator_time_stamps) - 1)
+        predator_tick_locations = predator_locations[predator_indices]
+        predator_tick_directions = 90 - predator_rotations[predator_indices]
+
+    for tick in range(first_tick, tick_count):
+        prey_state = cwgame.AgentState()
+        prey_state.location = tuple(prey_tick_locations[tick])
+        prey_state.direction = cwgame.direction(tuple(previous_locations[tick]), prey_state.location)
+        action = int(tick_actions[tick])
+        if has_predator:
+            predator_state = cwgame.AgentState()
+            predator_state.location = tuple(predator_tick_locations[tick])
+            predator_state.direction = predator_tick_directions[tick]
+            yield {"prey": prey_state, "predator": predator_state}, action
+        else:
+            yield {"prey": prey_state}, action
+
+
+def experiment_transitions(experiment_file: str,
+                           env: gymnasium.Env) -> typing.Dict[str, np.ndarray]:
+    """
+    Replays every episode of an experiment through the env and returns the resulting
+    transitions as a shard of stacked arrays (one row per transition).
+    """
+    experiment = cw.Experiment.load_from_file(experiment_file)
+    loader = env.get_wrapper_attr('loader')
+    actions = cell_locator(loader.world.cells.free_cells())
+    time_step = env.get_wrapper_attr('time_step')
+    reset = env.get_wrapper_attr('replay_reset')
+    step = env.get_wrapper_attr('replay_step')
+    shard = {"observations": [],
+             "next_observations": [],
+             "actions": [],
+             "rewards": [],
+             "dones": [],
+             "timeouts": []}
+    for episode in experiment.episodes:
+        prev_observation, infos = None, {}
+        for agents_state, action in get_agent_states_from_episode(episode=episode,
+                                                                  time_step=time_step,
+                                                                  actions=actions):
+            if prev_observation is None:
+                prev_observation, infos = reset(agents_state=agents_state)
+                continue
+
+            post_observation, reward, done, truncated, infos = step(agents_state=agents_state)
+            shard["observations"].append(prev_observation)
+            shard["next_observations"].append(post_observation)
+            shard["actions"].append(action)
+            shard["rewards"].append(reward)
+            shard["dones"].append(done)
+            shard["timeouts"].append(infos.get("TimeLimit.truncated", False))
+            prev_observation = post_observation
+
+            if done:
+                break
+
+    observation_space = env.observation_space
+    return {"observations": np.array(shard["observations"], dtype=observation_space.dtype).reshape((-1,) + observation_space.shape),
+            "next_observations": np.array(shard["next_observations"], dtype=observation_space.dtype).reshape((-1,) + observation_space.shape),
+            "actions": np.array(shard["actions"], dtype=np.int64),
+            "rewards": np.array(shard["rewards"], dtype=np.float32),
+            "dones": np.array(shard["dones"], dtype=np.float32),
+            "timeouts": np.array(shard["timeouts"], dtype=np.float32)}
+
+
+def fill_buffer(shard: typing.Dict[str, np.ndarray],
+                buffer: "ReplayBuffer",
+                buffer_size: int):
+    count = min(len(shard["actions"]), buffer_size - buffer.size())
+    if count <= 0:
+        return
+    positions = slice(buffer.pos, buffer.pos + count)
+    buffer.observations[positions, 0] = shard["observations"][:count]
+    if buffer.optimize_memory_usage:
+        buffer.observations[(buffer.pos + count) % buffer.buffer_size, 0] = shard["next_observations"][count - 1]
+    else:
+        buffer.next_observations[positions, 0] = shard["next_observations"][:count]
+    buffer.actions[positions, 0] = shard["actions"][:count].reshape((count,) + buffer.actions.shape[2:])
+    buffer.rewards[positions, 0] = shard["rewards"][:count]
+    buffer.dones[positions, 0] = shard["dones"][:count]
+    if buffer.handle_timeout_termination:
+        buffer.timeouts[positions, 0] = shard["timeouts"][:count]
+    buffer.pos += count
+    if buffer.pos == buffer.buffer_size:
+        buffer.full = True
+        buffer.pos = 0
+    print(f"{buffer.size()} out of {buffer_size} records so far")
+
+
+def cellworld_gym_version() -> str:
+    from importlib import metadata
+    try:
+        return metadata.version("cellworld_gym")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def transitions_cache_file(experiment_file: str,
+                           env_config: dict) -> str:
+    """
+    Content addressed location of the transitions derived from an experiment file:
+    the key covers the experiment file contents, every env setting that changes
+    the replayed observations, rewards or dones, the transitions format version
+    and the cellworld_gym version.
+    """
+    key = hashlib.sha256()
+    key.update(f"{transitions_format_version}:{cellworld_gym_version()}:".encode())
+    with open(experiment_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            key.update(chunk)
+    key.update(json.dumps(env_config, sort_keys=True).encode())
+    return os.path.join(config.transitions_cache_folder(), f"{key.hexdigest()}.npz")
+
+
+def cached_transitions(experiment_file: str,
+                       env: gymnasium.Env,
+                       env_config: dict,
+                       use_cache: bool = True) -> typing.Dict[str, np.ndarray]:
+    if not use_cache:
+        return experiment_transitions(experiment_file, env)
+    cache_file = transitions_cache_file(experiment_file, env_config)
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as shard:
+            return {field: shard[field] for field in shard.files}
+    shard = experiment_transitions(experiment_file, env)
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wb') as f:
+        np.savez_compressed(f, **shard)
+    os.replace(temp_file, cache_file)
+    return shard
+
+
+worker_envs = {}
+worker_env_configs = {}
+worker_settings = {"use_cache": True}
+
+
+def init_worker(task_name: str,
+                create_env: typing.Callable[..., gymnasium.Env],
+                model_config: dict,
+                cache_config_keys: typing.List[str],
+                use_cache: bool = True):
+    """
+    Builds the predator and no predator envs replaying the experiments in this process.
+
+    :param create_env: env factory of the task, it has to be importable by the pool worker processes
+    :param cache_config_keys: model configuration keys that change the replayed transitions of the task
+    """
+    for use_predator in (True, False):
+        env_config = dict(model_config, use_predator=use_predator)
+        worker_envs[use_predator] = create_env(use_lppos=False,
+                                               **env_config)
+        worker_env_configs[use_predator] = {key: env_config.get(key) for key in cache_config_keys}
+        worker_env_configs[use_predator].update(task=task_name, use_predator=use_predator)
+    worker_settings["use_cache"] = use_cache
+
+
+def worker_transitions(task: typing.Tuple[str, bool]) -> typing.Dict[str, np.ndarray]:
+    experiment_file, use_predator = task
+    return cached_transitions(experiment_file,
+                              worker_envs[use_predator],
+                              worker_env_configs[use_predator],
+                              use_cache=worker_settings["use_cache"])
+
+
+def replay_episode(episode: cw.Episode, env: gymnasium.Env):
+    env.model.prey.max_forward_speed = 0
+    env.model.prey.max_turning_speed = 0
+    env.model.predator.max_forward_speed = 0
+    env.model.predator.max_turning_speed = 0
+    for step in episode.trajectories:
+        env.step(step.action)
+
+
+def parse_experiment_file(experiment_file_path: str) -> typing.Optional[namedtuple]:
+    import re
+    import datetime
+    experiment_file_name = os.path.basename(experiment_file_path)
+    experiment_name = experiment_file_name.replace("_experiment.json", "")
+    ExperimentData = namedtuple("experiment_data",
+                                ["name", "prefix", "subject", "phase", "iteration", "date_time", "occlusions", "file_path"])
+    parts = experiment_name.split("_")
+    prefix = parts[0]
+    phase_iteration = parts[-1]
+    match = re.match(r'(\D+)(\d+)', phase_iteration)
+    if not match:
+        return None
+    phase = match.group(1)
+    iteration = int(match.group(2))
+    occlusions = "%s_%s" % (parts[-3], parts[-2])
+    subject = parts[-4]
+    date_time = datetime.datetime.strptime("%s_%s" % (parts[1], parts[2]), "%Y%m%d_%H%M")
+    data = ExperimentData(file_path=experiment_file_path,
+                          name=experiment_name,
+                          prefix=prefix,
+                          phase=phase,
+                          iteration=iteration,
+                          occlusions=occlusions,
+                          subject=subject,
+                          date_time=date_time)
+    return data
+
+
+def select_experiments(start_path: str,
+                       filter_by_phases: typing.Optional[str] = None,
+                       filter_by_subject: typing.Optional[str] = None,
+                       sort_by: typing.Optional[str] = None) -> list:
+    experiments = [parse_experiment_file(experiment_file_path=file_path) for file_path in experiment_files(start_path=start_path)]
+
+    experiments = [data for data in experiments if data]
+
+    if filter_by_phases:
+        phases_filter = filter_by_phases.split(",")
+        experiments = [data for data in experiments if data.phase in phases_filter]
+
+    if filter_by_subject:
+        subject_filter = filter_by_subject.split(",")
+        experiments = [data for data in experiments if data.subject in subject_filter]
+
+    if sort_by:
+        sort_by = sort_by.split(",")
+        experiments = sorted(experiments, key=lambda data: tuple([getattr(data, field) for field in sort_by]))
+    return experiments
+
+
+def replay_experiments(task_name: str,
+                       create_env: typing.Callable[..., gymnasium.Env],
+                       model_config: dict,
+                       cache_config_keys: typing.List[str],
+                       experiments: list,
+                       buffer_size: int,
+                       workers: int = 1,
+                       use_cache: bool = True) -> "ReplayBuffer":
+    """
+    Fills a ReplayBuffer with the transitions of the experiments, in their order, until it holds buffer_size transitions.
+    Experiments of the phases containing "R" are replayed with the predator.
+
+    :param workers: processes replaying experiments, 1 replays them in this process
+    :param use_cache: reuses the transitions cached by previous replays with the same cache key
+    """
+    from stable_baselines3.common.buffers import ReplayBuffer
+    init_worker(task_name, create_env, model_config, cache_config_keys, use_cache)
+
+    replay_buffer = ReplayBuffer(buffer_size=buffer_size,
+                                 observation_space=worker_envs[True].observation_space,
+                                 action_space=worker_envs[True].action_space)
+
+    tasks = [(data.file_path, "R" in data.phase) for data in experiments]
+
+    if workers > 1:
+        import multiprocessing
+        with multiprocessing.Pool(processes=workers,
+                                  initializer=init_worker,
+                                  initargs=(task_name, create_env, model_config, cache_config_keys, use_cache)) as pool:
+            # imap keeps the experiments order, so the sort_by order is preserved in the buffer
+            for data, shard in zip(experiments, pool.imap(worker_transitions, tasks)):
+                print(f"Loading experiment {data.name}")
+                fill_buffer(shard, replay_buffer, buffer_size)
+                if replay_buffer.size() == buffer_size:
+                    pool.terminate()
+                    break
+    else:
+        for data, task in zip(experiments, tasks):
+            print(f"Loading experiment {data.name}")
+            fill_buffer(worker_transitions(task), replay_buffer, buffer_size)
+            if replay_buffer.size() == buffer_size:
+                break
+    return replay_buffer
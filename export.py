@@ -0,0 +1,50 @@
+import os
+import json
+import argparse
+import config
+import inference
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI export tool: converts a trained model into a numpy policy for show, evaluation and opponent play')
+    parser.add_argument('task_name', type=str, help='task folder name (botevade, botevadebelief, dualevade, tlppo)')
+    parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
+    parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run', required=True)
+    parser.add_argument('-s', '--suffix', type=str, default="", help='data file suffix, e.g. mouse_1_best')
+    parser.add_argument('-c', '--cycle', type=int, help='model cycle')
+    parser.add_argument('-d', '--dtype', type=str, default="float16", choices=inference.weight_dtypes, help='weight dtype (default float16)')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_arguments()
+    except argparse.ArgumentError as e:
+        print("Error:", e)
+        exit(1)
+
+    run = config.RunContext(task_name=args.task_name,
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
+    model_configuration_file = run.model_config_file()
+
+    if not os.path.exists(model_configuration_file):
+        print(f"Model configuration file '{model_configuration_file}' not found")
+        exit(1)
+
+    run_data_file = run.data_file(suffix=args.suffix)
+    if args.cycle:
+        run_data_file = run_data_file.replace(".zip", f"_{args.cycle}.zip")
+
+    if not os.path.exists(run_data_file):
+        print(f"Data file '{run_data_file}' not found")
+        exit(1)
+
+    model_config = json.loads(open(model_configuration_file).read())
+    from algorightms import algorithms
+    model = algorithms[model_config["algorithm"]].load(run_data_file)
+
+    output_file = inference.policy_file(run_data_file, args.dtype)
+    inference.export_policy(model, output_file, dtype=args.dtype)
+    print(f"Numpy policy saved to '{output_file}' ({os.path.getsize(output_file) / 2 ** 10:.1f}KB)")
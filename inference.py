@@ -0,0 +1,183 @@
+import json
+import typing
+import numpy as np
+
+weight_dtypes = ["float32", "float16", "int8"]
+
+activations = {"relu": lambda x: np.maximum(x, 0, out=x),
+               "tanh": lambda x: np.tanh(x, out=x)}
+
+
+def policy_file(data_file: str, dtype: str = "float16") -> str:
+    return data_file.replace(".zip", f"_{dtype}.npz")
+
+
+class NumpyPolicy:
+    """
+    Deterministic forward pass of an exported SB3 MLP policy that only needs numpy.
+
+    Weights are stored as float32, float16 or int8 (symmetric, one scale per output unit) and
+    expanded to float32 when loaded: the networks are small and numpy has no fast float16/int8
+    matmul, so the stored dtype only trades file size against agreement with the original policy.
+    predict mirrors BaseAlgorithm.predict so the policy can replace the model in show/evaluate
+    scripts and as the other agent policy.
+
+    :param layers: (weight, bias, activation) per linear layer, weight shaped (inputs, outputs)
+    :param head: "argmax" (q values), "quantile_mean" (quantiles per action) or "logits" (categorical actor)
+    :param observation_shape: shape of a single observation
+    :param n_quantiles: quantiles per action for the "quantile_mean" head
+    """
+    def __init__(self,
+                 layers: typing.List[typing.Tuple[np.ndarray, np.ndarray, typing.Optional[str]]],
+                 head: str,
+                 observation_shape: typing.Tuple[int, ...],
+                 n_quantiles: int = 0):
+        self.layers = layers
+        self.head = head
+        self.observation_shape = tuple(observation_shape)
+        self.n_quantiles = n_quantiles
+        self.generator = np.random.default_rng()
+
+    def forward(self, observations: np.ndarray) -> np.ndarray:
+        x = np.asarray(observations, dtype=np.float32).reshape(observations.shape[0], -1)
+        for weight, bias, activation in self.layers:
+            x = x @ weight
+            x += bias
+            if activation:
+                x = activations[activation](x)
+        if self.head == "quantile_mean":
+            x = x.reshape(x.shape[0], self.n_quantiles, -1).mean(axis=1)
+        return x
+
+    def predict(self,
+                observation: np.ndarray,
+                state: typing.Any = None,
+                episode_start: typing.Any = None,
+                deterministic: bool = True) -> typing.Tuple[np.ndarray, None]:
+        observation = np.asarray(observation, dtype=np.float32)
+        vectorized = observation.shape != self.observation_shape
+        observations = observation.reshape((-1,) + self.observation_shape)
+        outputs = self.forward(observations)
+        if self.head == "logits" and not deterministic:
+            probabilities = np.exp(outputs - outputs.max(axis=1, keepdims=True))
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            random_values = self.generator.random((outputs.shape[0], 1))
+            actions = (probabilities.cumsum(axis=1) < random_values).sum(axis=1)
+            actions = np.minimum(actions, outputs.shape[1] - 1)
+        else:
+            actions = outputs.argmax(axis=1)
+        if not vectorized:
+            actions = actions.squeeze(axis=0)
+        return actions, None
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyPolicy":
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            layers = []
+            for index, activation in enumerate(metadata["activations"]):
+                weight = data[f"weight_{index}"].astype(np.float32)
+                if metadata["dtype"] == "int8":
+                    weight *= data[f"scale_{index}"]
+                layers.append((np.ascontiguousarray(weight), data[f"bias_{index}"].astype(np.float32), activation))
+        return cls(layers=layers,
+                   head=metadata["head"],
+                   observation_shape=metadata["observation_shape"],
+                   n_quantiles=metadata.get("n_quantiles", 0))
+
+
+def _sequential_layers(modules: typing.Iterable) -> typing.List[typing.Tuple[np.ndarray, np.ndarray, typing.Optional[str]]]:
+    import torch
+    layers = []
+    for module in modules:
+        if isinstance(module, torch.nn.Linear):
+            layers.append([module.weight.detach().cpu().numpy().T.astype(np.float32),
+                           module.bias.detach().cpu().numpy().astype(np.float32),
+                           None])
+        elif isinstance(module, (torch.nn.ReLU, torch.nn.Tanh)):
+            if not layers or layers[-1][2]:
+                raise ValueError(f"Activation {module} does not follow a linear layer")
+            layers[-1][2] = "relu" if isinstance(module, torch.nn.ReLU) else "tanh"
+        elif isinstance(module, (torch.nn.Identity, torch.nn.Flatten)):
+            continue
+        else:
+            raise ValueError(f"Unsupported layer {module}, only Linear, ReLU and Tanh layers can be exported")
+    return [tuple(layer) for layer in layers]
+
+
+def convert_policy(model) -> NumpyPolicy:
+    """
+    Copies the greedy path of a trained SB3 model: the q network of DQN, the quantile network of
+    QRDQN (actions ranked by their mean quantile) or the actor of PPO/TRPO (argmax of the logits).
+    Only flat Box observations with the default flatten features extractor are supported.
+    """
+    from gymnasium import spaces
+    from stable_baselines3.common.torch_layers import FlattenExtractor
+    policy = model.policy
+    if not isinstance(model.observation_space, spaces.Box) or not isinstance(model.action_space, spaces.Discrete):
+        raise ValueError("Only Box observation and Discrete action spaces can be exported")
+    n_quantiles = 0
+    if hasattr(policy, "quantile_net"):
+        network = policy.quantile_net
+        modules = network.quantile_net
+        head = "quantile_mean"
+        n_quantiles = network.n_quantiles
+        features_extractor = network.features_extractor
+    elif hasattr(policy, "q_net"):
+        network = policy.q_net
+        modules = network.q_net
+        head = "argmax"
+        features_extractor = network.features_extractor
+    elif hasattr(policy, "mlp_extractor") and hasattr(policy, "action_net"):
+        if hasattr(policy, "lstm_actor"):
+            raise ValueError("Recurrent policies cannot be exported")
+        modules = list(policy.mlp_extractor.policy_net) + [policy.action_net]
+        head = "logits"
+        features_extractor = policy.pi_features_extractor
+    else:
+        raise ValueError(f"Unsupported policy {type(policy).__name__}")
+    if not isinstance(features_extractor, FlattenExtractor):
+        raise ValueError(f"Unsupported features extractor {type(features_extractor).__name__}")
+    return NumpyPolicy(layers=_sequential_layers(modules),
+                       head=head,
+                       observation_shape=model.observation_space.shape,
+                       n_quantiles=n_quantiles)
+
+
+def save_policy(numpy_policy: NumpyPolicy, path: str, dtype: str = "float16") -> None:
+    if dtype not in weight_dtypes:
+        raise ValueError(f"Unknown weight dtype '{dtype}', expected one of {weight_dtypes}")
+    arrays = {}
+    for index, (weight, bias, _) in enumerate(numpy_policy.layers):
+        if dtype == "int8":
+            scale = np.abs(weight).max(axis=0, keepdims=True) / 127
+            scale[scale == 0] = 1
+            arrays[f"weight_{index}"] = np.round(weight / scale).astype(np.int8)
+            arrays[f"scale_{index}"] = scale.astype(np.float32)
+        else:
+            arrays[f"weight_{index}"] = weight.astype(dtype)
+        arrays[f"bias_{index}"] = bias.astype(np.float32)
+    metadata = {"dtype": dtype,
+                "head": numpy_policy.head,
+                "observation_shape": list(numpy_policy.observation_shape),
+                "n_quantiles": numpy_policy.n_quantiles,
+                "activations": [activation for _, _, activation in numpy_policy.layers]}
+    with open(path, "wb") as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+
+
+def export_policy(model, path: str, dtype: str = "float16") -> NumpyPolicy:
+    """
+    Converts a trained SB3 model and saves it to path, returning the policy as it loads from the file.
+    """
+    save_policy(convert_policy(model), path, dtype=dtype)
+    return NumpyPolicy.load(path)
+
+
+def load_policy(data_file: str, algorithm, dtype: typing.Optional[str] = None):
+    """
+    Loads the SB3 model saved in data_file, or its numpy export in the given weight dtype.
+    """
+    if dtype is None:
+        return algorithm.load(data_file)
+    return NumpyPolicy.load(policy_file(data_file, dtype))
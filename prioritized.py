@@ -0,0 +1,118 @@
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import DQN
+from sb3_contrib.qrdqn import QRDQN
+from replay_buffers import is_prioritized
+
+
+def annealed_beta(model) -> float:
+    # importance sampling correction grows from the buffer beta to 1 at the end of the training
+    beta = model.replay_buffer.beta
+    return beta + (1 - beta) * (1 - model._current_progress_remaining)
+
+
+def quantile_huber_losses(current_quantiles: th.Tensor, target_quantiles: th.Tensor) -> th.Tensor:
+    """
+    Quantile huber loss of each sample of the batch, summed over the quantiles
+    like sb3_contrib quantile_huber_loss(sum_over_quantiles=True) before its batch mean.
+    """
+    n_quantiles = current_quantiles.shape[-1]
+    cum_prob = (th.arange(n_quantiles, device=current_quantiles.device, dtype=th.float) + 0.5) / n_quantiles
+    cum_prob = cum_prob.view(1, -1, 1)
+    pairwise_delta = target_quantiles.unsqueeze(-2) - current_quantiles.unsqueeze(-1)
+    abs_pairwise_delta = th.abs(pairwise_delta)
+    huber_loss = th.where(abs_pairwise_delta > 1, abs_pairwise_delta - 0.5, pairwise_delta ** 2 * 0.5)
+    loss = th.abs(cum_prob - (pairwise_delta.detach() < 0).float()) * huber_loss
+    return loss.sum(dim=-2).mean(dim=-1)
+
+
+class PrioritizedDQN(DQN):
+    """
+    DQN trained from a PrioritizedReplayBuffer: the huber losses are weighted by the importance
+    sampling weights of the batch and the absolute TD errors become the new priorities of the
+    sampled transitions. Trains like DQN when the replay buffer is not prioritized
+    (or a MixedReplayBuffer whose online buffer is not).
+    """
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        if not is_prioritized(self.replay_buffer):
+            return super().train(gradient_steps, batch_size)
+        self.policy.set_training_mode(True)
+        self._update_learning_rate(self.policy.optimizer)
+        beta = annealed_beta(self)
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env, beta=beta)
+
+            with th.no_grad():
+                next_q_values = self.q_net_target(replay_data.next_observations)
+                next_q_values, _ = next_q_values.max(dim=1)
+                next_q_values = next_q_values.reshape(-1, 1)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            current_q_values = self.q_net(replay_data.observations)
+            current_q_values = th.gather(current_q_values, dim=1, index=replay_data.actions.long())
+
+            elementwise_loss = F.smooth_l1_loss(current_q_values, target_q_values, reduction="none")
+            loss = (replay_data.weights * elementwise_loss).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            td_errors = (current_q_values - target_q_values).detach().abs().cpu().numpy().reshape(-1)
+            self.replay_buffer.update_priorities(replay_data.indices, td_errors)
+
+        self._n_updates += gradient_steps
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
+        self.logger.record("train/per_beta", beta)
+
+
+class PrioritizedQRDQN(QRDQN):
+    """
+    QRDQN trained from a PrioritizedReplayBuffer: the quantile huber loss of each sample is
+    weighted by its importance sampling weight and becomes its new priority.
+    Trains like QRDQN when the replay buffer is not prioritized (or a MixedReplayBuffer whose online buffer is not).
+    """
+    def train(self, gradient_steps: int, batch_size: int = 100) -> None:
+        if not is_prioritized(self.replay_buffer):
+            return super().train(gradient_steps, batch_size)
+        self.policy.set_training_mode(True)
+        self._update_learning_rate(self.policy.optimizer)
+        beta = annealed_beta(self)
+
+        losses = []
+        for _ in range(gradient_steps):
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env, beta=beta)
+
+            with th.no_grad():
+                next_quantiles = self.quantile_net_target(replay_data.next_observations)
+                next_greedy_actions = next_quantiles.mean(dim=1, keepdim=True).argmax(dim=2, keepdim=True)
+                next_greedy_actions = next_greedy_actions.expand(batch_size, self.n_quantiles, 1)
+                next_quantiles = next_quantiles.gather(dim=2, index=next_greedy_actions).squeeze(dim=2)
+                target_quantiles = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_quantiles
+
+            current_quantiles = self.quantile_net(replay_data.observations)
+            actions = replay_data.actions[..., None].long().expand(batch_size, self.n_quantiles, 1)
+            current_quantiles = th.gather(current_quantiles, dim=2, index=actions).squeeze(dim=2)
+
+            sample_losses = quantile_huber_losses(current_quantiles, target_quantiles)
+            loss = (replay_data.weights.reshape(-1) * sample_losses).mean()
+            losses.append(loss.item())
+
+            self.policy.optimizer.zero_grad()
+            loss.backward()
+            if self.max_grad_norm is not None:
+                th.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm)
+            self.policy.optimizer.step()
+
+            self.replay_buffer.update_priorities(replay_data.indices, sample_losses.detach().cpu().numpy())
+
+        self._n_updates += gradient_steps
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        self.logger.record("train/loss", np.mean(losses))
+        self.logger.record("train/per_beta", beta)
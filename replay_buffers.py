@@ -0,0 +1,421 @@
+import os
+import json
+import typing
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+from stable_baselines3.common.type_aliases import ReplayBufferSamples
+from stable_baselines3.common.vec_env import VecNormalize
+
+header_file_name = "header.json"
+buffer_fields = ["observations", "next_observations", "actions", "rewards", "dones", "timeouts"]
+
+
+def action_storage_dtype(action_space: spaces.Space) -> np.dtype:
+    """
+    Smallest dtype that stores the actions exactly: discrete actions fit an unsigned int
+    sized for the largest action index, other action spaces keep their own dtype.
+    """
+    if isinstance(action_space, spaces.Discrete):
+        return np.min_scalar_type(int(action_space.start + action_space.n - 1))
+    if isinstance(action_space, spaces.MultiDiscrete):
+        return np.min_scalar_type(int(action_space.nvec.max() - 1))
+    return np.dtype(np.float32) if action_space.dtype == np.float64 else action_space.dtype
+
+
+def transition_bytes(buffer: ReplayBuffer) -> float:
+    """
+    Bytes of storage per transition of the buffer, observations shared between consecutive
+    transitions (optimize_memory_usage) are counted once.
+    """
+    total = sum(getattr(buffer, field).nbytes for field in buffer_fields if getattr(buffer, field, None) is not None)
+    if isinstance(buffer, PrioritizedReplayBuffer):
+        total += buffer.tree.nodes.nbytes
+    return total / (buffer.buffer_size * buffer.n_envs)
+
+
+def report_replay_buffer(buffer: ReplayBuffer) -> None:
+    per_transition = transition_bytes(buffer)
+    capacity = buffer.buffer_size * buffer.n_envs
+    print(f"replay buffer {type(buffer).__name__}: {per_transition:.1f} bytes per transition, "
+          f"{capacity} transitions, {per_transition * capacity / 2 ** 30:.2f}GB")
+
+
+class CompactReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer storing the observations as float16 and the actions in the smallest dtype that
+    holds them exactly (uint8 for up to 256 discrete actions). With optimize_memory_usage the
+    next observation of a transition is read from the next slot instead of being stored twice,
+    which SB3 only supports without timeout handling: truncated episodes are then stored as terminal.
+
+    Sampled batches are cast back to float32 observations and the action space dtype, so the
+    algorithms train on the same tensors as with ReplayBuffer.
+    """
+    def __init__(self,
+                 buffer_size: int,
+                 observation_space: spaces.Space,
+                 action_space: spaces.Space,
+                 device: str = "auto",
+                 n_envs: int = 1,
+                 optimize_memory_usage: bool = True,
+                 handle_timeout_termination: bool = False,
+                 observation_dtype: typing.Union[str, np.dtype] = np.float16):
+        if optimize_memory_usage and handle_timeout_termination:
+            raise ValueError("optimize_memory_usage requires handle_timeout_termination=False")
+        # BaseBuffer only records the sizes, ReplayBuffer.__init__ would allocate float32 arrays
+        BaseBuffer.__init__(self,
+                            buffer_size,
+                            observation_space,
+                            action_space,
+                            device=device,
+                            n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = optimize_memory_usage
+        self.handle_timeout_termination = handle_timeout_termination
+        self.observations = np.zeros((self.buffer_size, self.n_envs, *self.obs_shape), dtype=observation_dtype)
+        self.next_observations = None if optimize_memory_usage else np.zeros_like(self.observations)
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=action_storage_dtype(action_space))
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+    def _get_samples(self,
+                     batch_inds: np.ndarray,
+                     env: typing.Optional[VecNormalize] = None) -> ReplayBufferSamples:
+        env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        return ReplayBufferSamples(*tuple(map(self.to_torch, self._transitions(batch_inds, env_indices, env))))
+
+    def _transitions(self,
+                     batch_inds: np.ndarray,
+                     env_indices: np.ndarray,
+                     env: typing.Optional[VecNormalize] = None) -> typing.Tuple[np.ndarray, ...]:
+        if self.optimize_memory_usage:
+            next_observations = self.observations[(batch_inds + 1) % self.buffer_size, env_indices, :]
+        else:
+            next_observations = self.next_observations[batch_inds, env_indices, :]
+        observation_dtype = np.float32 if self.observation_space.dtype == np.float64 else self.observation_space.dtype
+        action_dtype = np.float32 if self.action_space.dtype == np.float64 else self.action_space.dtype
+        return (self._normalize_obs(self.observations[batch_inds, env_indices, :].astype(observation_dtype, copy=False), env),
+                self.actions[batch_inds, env_indices, :].astype(action_dtype, copy=False),
+                self._normalize_obs(next_observations.astype(observation_dtype, copy=False), env),
+                (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+                self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env))
+
+
+class SumTree:
+    """
+    Binary sum tree over capacity leaves stored in a single array: node i has children 2i and 2i+1
+    and the leaves start at the first power of two >= capacity. Updates and prefix sum searches
+    take a whole batch at once and run one numpy operation per tree level, O(log n) each.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.leaf_start = 1 << max(capacity - 1, 0).bit_length()
+        self.depth = self.leaf_start.bit_length() - 1
+        self.nodes = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+    def total(self) -> float:
+        return float(self.nodes[1])
+
+    def values(self, leaves: np.ndarray) -> np.ndarray:
+        return self.nodes[leaves + self.leaf_start]
+
+    def update(self, leaves: np.ndarray, values: np.ndarray) -> None:
+        nodes = leaves + self.leaf_start
+        self.nodes[nodes] = values
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, prefix_sums: np.ndarray) -> np.ndarray:
+        """
+        Leaf of each prefix sum: the first leaf whose cumulative value reaches it.
+        """
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sums = self.nodes[left]
+            right = prefix_sums > left_sums
+            prefix_sums = np.where(right, prefix_sums - left_sums, prefix_sums)
+            nodes = np.where(right, left + 1, left)
+        return np.minimum(nodes - self.leaf_start, self.capacity - 1)
+
+
+class PrioritizedReplayBufferSamples(typing.NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+
+class PrioritizedReplayBuffer(CompactReplayBuffer):
+    """
+    Proportional prioritized experience replay (Schaul et al. 2016): transitions are sampled with
+    probability priority^alpha / sum(priority^alpha) from a SumTree with one leaf per (slot, env),
+    new transitions get the largest priority seen so far. Samples carry the leaf indices, to be
+    passed back to update_priorities with their TD errors, and the importance sampling weights
+    (N * P(i))^-beta normalized by the largest weight of the batch.
+
+    Observations are stored as float32 by default, pass observation_dtype=np.float16 to combine
+    it with the compact storage. Next observation sharing is not supported: the slot about to be
+    overwritten would keep a stale priority.
+    """
+    def __init__(self,
+                 buffer_size: int,
+                 observation_space: spaces.Space,
+                 action_space: spaces.Space,
+                 device: str = "auto",
+                 n_envs: int = 1,
+                 optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True,
+                 observation_dtype: typing.Union[str, np.dtype] = np.float32,
+                 alpha: float = 0.6,
+                 beta: float = 0.4,
+                 epsilon: float = 1e-6):
+        if optimize_memory_usage:
+            raise ValueError("PrioritizedReplayBuffer does not support optimize_memory_usage")
+        super().__init__(buffer_size,
+                         observation_space,
+                         action_space,
+                         device=device,
+                         n_envs=n_envs,
+                         optimize_memory_usage=False,
+                         handle_timeout_termination=handle_timeout_termination,
+                         observation_dtype=observation_dtype)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+
+    def add(self, obs, next_obs, action, reward, done, infos) -> None:
+        leaves = self.pos * self.n_envs + np.arange(self.n_envs)
+        super().add(obs, next_obs, action, reward, done, infos)
+        self.tree.update(leaves, np.full(self.n_envs, self.max_priority ** self.alpha))
+
+    def sample(self,
+               batch_size: int,
+               env: typing.Optional[VecNormalize] = None,
+               beta: typing.Optional[float] = None) -> PrioritizedReplayBufferSamples:
+        beta = self.beta if beta is None else beta
+        total = self.tree.total()
+        transition_count = self.size() * self.n_envs
+        # one prefix sum per equal segment of the total priority
+        bounds = np.linspace(0, total, batch_size + 1)
+        leaves = self.tree.find(np.random.uniform(bounds[:-1], bounds[1:]))
+        priorities = self.tree.values(leaves)
+        empty = priorities == 0
+        if empty.any():
+            # prefix sums rounded past the last filled leaf
+            leaves[empty] = np.random.randint(0, transition_count, size=int(empty.sum()))
+            priorities = self.tree.values(leaves)
+        weights = (transition_count * priorities / total) ** -beta
+        weights /= weights.max()
+        batch_inds, env_indices = np.divmod(leaves, self.n_envs)
+        data = tuple(map(self.to_torch, self._transitions(batch_inds, env_indices, env)))
+        return PrioritizedReplayBufferSamples(*data,
+                                              weights=self.to_torch(weights.astype(np.float32).reshape(-1, 1)),
+                                              indices=leaves)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+
+def save_memmap_buffer(buffer: ReplayBuffer, folder: str) -> None:
+    """
+    Saves a replay buffer as one .npy file per field plus a JSON header,
+    the files can be memory mapped back with MemmapReplayBuffer.load.
+    """
+    os.makedirs(folder, exist_ok=True)
+    header = {"buffer_size": buffer.buffer_size,
+              "n_envs": buffer.n_envs,
+              "pos": buffer.pos,
+              "full": buffer.full,
+              "optimize_memory_usage": buffer.optimize_memory_usage,
+              "handle_timeout_termination": buffer.handle_timeout_termination,
+              "fields": {}}
+    for field in buffer_fields:
+        values = getattr(buffer, field, None)
+        if values is None:
+            continue
+        # write next to the destination and swap, the previous file may still be mapped by this buffer
+        file_path = os.path.join(folder, f"{field}.npy")
+        mapped = np.lib.format.open_memmap(f"{file_path}.tmp",
+                                           mode="w+",
+                                           dtype=values.dtype,
+                                           shape=values.shape)
+        mapped[:] = values
+        mapped.flush()
+        del mapped
+        os.replace(f"{file_path}.tmp", file_path)
+        header["fields"][field] = {"dtype": values.dtype.str, "shape": list(values.shape)}
+    with open(os.path.join(folder, header_file_name), "w") as f:
+        json.dump(header, f)
+
+
+def is_memmap_buffer(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, header_file_name))
+
+
+class MemmapReplayBuffer(CompactReplayBuffer):
+    """
+    ReplayBuffer whose storage arrays are memory mapped from a folder written by save_memmap_buffer.
+    Loading does not read the transitions, sampling only touches the sampled rows, and processes
+    mapping the same files share the page cache.
+
+    Use mode "r" for read only consumers and "c" (copy on write) to keep adding transitions
+    in memory without modifying the files. Buffers saved from a CompactReplayBuffer keep
+    their compact dtypes and are sampled the same way.
+    """
+    def __init__(self,
+                 folder: str,
+                 observation_space: spaces.Space,
+                 action_space: spaces.Space,
+                 device: str = "auto",
+                 mode: str = "r"):
+        with open(os.path.join(folder, header_file_name)) as f:
+            header = json.load(f)
+        # BaseBuffer only records the sizes, ReplayBuffer.__init__ would allocate the arrays
+        BaseBuffer.__init__(self,
+                            header["buffer_size"],
+                            observation_space,
+                            action_space,
+                            device=device,
+                            n_envs=header["n_envs"])
+        self.folder = folder
+        self.optimize_memory_usage = header["optimize_memory_usage"]
+        self.handle_timeout_termination = header["handle_timeout_termination"]
+        self.pos = header["pos"]
+        self.full = header["full"]
+        self.next_observations = None
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        for field, layout in header["fields"].items():
+            mapped = np.load(os.path.join(folder, f"{field}.npy"), mmap_mode=mode)
+            if list(mapped.shape) != layout["shape"]:
+                raise ValueError(f"{field}.npy has shape {mapped.shape}, header expects {layout['shape']}")
+            setattr(self, field, mapped)
+        if self.observations.shape[2:] != self.obs_shape:
+            raise ValueError(f"buffer observations {self.observations.shape[2:]} do not match the observation space {self.obs_shape}")
+
+    @classmethod
+    def load(cls,
+             folder: str,
+             observation_space: spaces.Space,
+             action_space: spaces.Space,
+             device: str = "auto",
+             mode: str = "r") -> "MemmapReplayBuffer":
+        return cls(folder, observation_space, action_space, device=device, mode=mode)
+
+
+def open_replay_buffer(path: str,
+                       observation_space: spaces.Space,
+                       action_space: spaces.Space,
+                       device: str = "auto") -> ReplayBuffer:
+    """
+    Opens a replay buffer read only, memory mapped when saved by save_memmap_buffer,
+    otherwise unpickled from a legacy buffer file (path or path.pickle, the name runs
+    saved before the memory mapped buffers).
+    """
+    if is_memmap_buffer(path):
+        return MemmapReplayBuffer.load(path,
+                                       observation_space=observation_space,
+                                       action_space=action_space,
+                                       device=device)
+    if not os.path.exists(path) and os.path.exists(f"{path}.pickle"):
+        path = f"{path}.pickle"
+    import pickle
+    with open(path, 'rb') as f:
+        buffer = pickle.load(f)
+    if device != "auto":
+        buffer.device = th.device(device)
+    return buffer
+
+
+def is_prioritized(buffer) -> bool:
+    return isinstance(getattr(buffer, "online_buffer", buffer), PrioritizedReplayBuffer)
+
+
+class MixedReplayBuffer:
+    """
+    Replay buffer of an off-policy model that keeps demonstration transitions apart from the
+    transitions collected online. The model adds to and saves the online buffer, every sampled
+    batch takes round(demo_ratio * batch_size) transitions from the demonstration buffer and the
+    rest from the online buffer, so the demonstrations are never overwritten or copied.
+
+    Attributes other than add/sample/update_priorities are those of the online buffer, which keeps
+    SB3 and save_memmap_buffer working on it. With a prioritized online buffer the demonstration
+    transitions get weight 1 and only the online transitions get their priorities updated.
+
+    :param online_buffer: buffer the model adds its transitions to
+    :param demo_buffer: read only buffer with the demonstrations, e.g. a MemmapReplayBuffer opened with mode "r"
+    :param demo_ratio: fraction of each batch sampled from the demonstrations
+    """
+    def __init__(self,
+                 online_buffer: ReplayBuffer,
+                 demo_buffer: ReplayBuffer,
+                 demo_ratio: float = 0.25):
+        if not 0 <= demo_ratio <= 1:
+            raise ValueError(f"demo_ratio must be between 0 and 1, got {demo_ratio}")
+        if demo_buffer.obs_shape != online_buffer.obs_shape:
+            raise ValueError(f"demonstration observations {demo_buffer.obs_shape} do not match the model observations {online_buffer.obs_shape}")
+        self.online_buffer = online_buffer
+        self.demo_buffer = demo_buffer
+        self.demo_ratio = demo_ratio
+
+    def __getattr__(self, name: str):
+        if name in ("online_buffer", "demo_buffer", "demo_ratio"):
+            raise AttributeError(name)
+        return getattr(self.online_buffer, name)
+
+    def add(self, *args, **kwargs) -> None:
+        self.online_buffer.add(*args, **kwargs)
+
+    def sample(self,
+               batch_size: int,
+               env: typing.Optional[VecNormalize] = None,
+               **kwargs):
+        demo_count = round(batch_size * self.demo_ratio) if self.demo_buffer.size() > 0 else 0
+        if self.online_buffer.size() == 0:
+            demo_count = batch_size
+        online_count = batch_size - demo_count
+        if demo_count == 0:
+            return self.online_buffer.sample(batch_size, env=env, **kwargs)
+        demo_samples = self.demo_buffer.sample(demo_count, env=env)
+        demo_weights = th.ones_like(demo_samples.rewards)
+        if online_count == 0:
+            fields = list(demo_samples[:5])
+            weights, indices = demo_weights, np.zeros(0, dtype=np.int64)
+        else:
+            online_samples = self.online_buffer.sample(online_count, env=env, **kwargs)
+            fields = [th.cat([online_field, demo_field]) for online_field, demo_field in zip(online_samples[:5], demo_samples[:5])]
+            if isinstance(online_samples, PrioritizedReplayBufferSamples):
+                weights, indices = th.cat([online_samples.weights, demo_weights]), online_samples.indices
+        if is_prioritized(self):
+            return PrioritizedReplayBufferSamples(*fields, weights=weights, indices=indices)
+        return ReplayBufferSamples(*fields)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        # the online transitions come first in the mixed batches
+        if len(indices):
+            self.online_buffer.update_priorities(indices, td_errors[:len(indices)])
+
+
+def mix_demonstrations(model, path: str, demo_ratio: float = 0.25) -> None:
+    """
+    Replaces the replay buffer of an off-policy model with a MixedReplayBuffer sampling the
+    demonstrations saved at path (memory mapped read only when saved by save_memmap_buffer).
+    """
+    demo_buffer = open_replay_buffer(path,
+                                     observation_space=model.observation_space,
+                                     action_space=model.action_space,
+                                     device=model.device)
+    online_buffer = getattr(model.replay_buffer, "online_buffer", model.replay_buffer)
+    model.replay_buffer = MixedReplayBuffer(online_buffer, demo_buffer, demo_ratio=demo_ratio)
+    print(f"sampling {demo_ratio:.0%} of each batch from {demo_buffer.size() * demo_buffer.n_envs} demonstration transitions")
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import random
+import typing
+import argparse
+import itertools
+import subprocess
+import config
+
+repository_folder = os.path.dirname(os.path.abspath(__file__))
+process_backends = ["subproc", "shm"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI sweep tool: trains a set of trials generated from a base model configuration')
+    parser.add_argument('task_name', type=str, help='task folder name (botevade, botevadebelief, dualevade, tlppo)')
+    parser.add_argument('model_name', type=str, help='name of the base model file in the models folder')
+    parser.add_argument('sweep_file', type=str, help='JSON sweep specification with "grid" and/or "random" parameters')
+    parser.add_argument('-n', '--sweep_name', type=str, help='name of the sweep, used as run identifier of the trials', required=False)
+    parser.add_argument('-c', '--cpus', type=int, help='cpu budget for the concurrent trials (default all cores)', required=False)
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed for the random parameters (default 0)')
+    parser.add_argument('-a', '--train_arguments', type=str, default="", help='extra arguments for train.py, e.g. "-t"')
+    parser.add_argument('-so', '--summary_only', action='store_true', help='only rebuilds the summary of an existing sweep')
+    args = parser.parse_args()
+    return args
+
+
+def sample_value(distribution: dict, generator: random.Random):
+    if "choice" in distribution:
+        return generator.choice(distribution["choice"])
+    if "uniform" in distribution:
+        low, high = distribution["uniform"]
+        return generator.uniform(low, high)
+    if "log_uniform" in distribution:
+        import math
+        low, high = distribution["log_uniform"]
+        return math.exp(generator.uniform(math.log(low), math.log(high)))
+    if "int_uniform" in distribution:
+        low, high = distribution["int_uniform"]
+        return generator.randint(low, high)
+    raise ValueError(f"Unknown distribution {distribution}, expected choice, uniform, log_uniform or int_uniform")
+
+
+def trial_parameters(sweep: dict, seed: int = 0) -> typing.List[dict]:
+    """
+    Expands a sweep specification into the parameters of each trial.
+
+    {"grid": {"learning_rate": [1e-5, 1e-4]},
+     "random": {"batch_size": {"choice": [128, 256]}, "gamma": {"uniform": [0.9, 0.99]}},
+     "samples": 4,
+     "pruning": {"check_steps": 10000, "patience": 5}}
+
+    every grid combination is trained with "samples" draws of the random parameters (default 1),
+    "pruning" is passed to the SurvivalPruningCallback of every trial.
+    """
+    grid = sweep.get("grid", {})
+    distributions = sweep.get("random", {})
+    samples = sweep.get("samples", 1) if distributions else 1
+    generator = random.Random(seed)
+    trials = []
+    for values in itertools.product(*grid.values()):
+        for _ in range(samples):
+            parameters = dict(zip(grid.keys(), values))
+            for name, distribution in distributions.items():
+                parameters[name] = sample_value(distribution, generator)
+            trials.append(parameters)
+    return trials
+
+
+def trial_cpus(model_config: dict, cpus: int) -> int:
+    # the learner plus one process per env when the envs run in worker processes
+    cpus_needed = 1
+    if model_config.get("vec_env_backend", "dummy") in process_backends:
+        cpus_needed += model_config.get("environment_count", 1)
+    return min(cpus_needed, cpus)
+
+
+def write_trials(task_name: str,
+                 model_name: str,
+                 sweep_name: str,
+                 sweep: dict,
+                 seed: int,
+                 model_configs_folder: str,
+                 pruning_reports_folder: str) -> typing.List[typing.Tuple[str, dict]]:
+    """
+    Writes the model configuration of every trial to model_configs_folder, outside the tracked models folder.
+    """
+    os.makedirs(model_configs_folder, exist_ok=True)
+    base_run = config.RunContext(task_name=task_name, model_name=model_name, run_identifier=sweep_name)
+    with open(base_run.model_config_file()) as f:
+        base_config = json.load(f)
+    trials = []
+    for trial_index, parameters in enumerate(trial_parameters(sweep, seed=seed)):
+        trial_model_name = f"{model_name}_{sweep_name}_{trial_index:03}"
+        trial_config = dict(base_config)
+        trial_config.update(parameters)
+        if "pruning" in sweep:
+            # trials compare their survival rate against each other through the shared reports folder
+            trial_config["pruning"] = dict(trial_config.get("pruning", {}), **sweep["pruning"])
+        if "pruning" in trial_config:
+            trial_config["pruning"] = dict(trial_config["pruning"], reports_folder=pruning_reports_folder)
+        trial_run = config.RunContext(task_name=task_name,
+                                      model_name=trial_model_name,
+                                      run_identifier=sweep_name,
+                                      model_configs_folder=model_configs_folder)
+        with open(trial_run.model_config_file(), 'w') as f:
+            json.dump(trial_config, f, indent=1)
+        trials.append((trial_model_name, parameters))
+    return trials
+
+
+def run_trials(task_name: str,
+               sweep_name: str,
+               trials: typing.List[typing.Tuple[str, dict]],
+               model_configs_folder: str,
+               cpus: int,
+               train_arguments: typing.List[str]) -> typing.Dict[str, int]:
+    """
+    Launches the trials as train.py processes, starting the next trial whenever
+    the cpus it needs are free, and waits for all of them to finish.
+
+    :return: exit code of each trial
+    """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([repository_folder, environment.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+    # each trial gets its share of cores, torch/numpy threads would oversubscribe them
+    environment.setdefault("OMP_NUM_THREADS", "1")
+    environment.setdefault("MKL_NUM_THREADS", "1")
+    train_script = os.path.join(repository_folder, "tasks", task_name, "train.py")
+
+    pending = list(trials)
+    running: typing.Dict[str, typing.Tuple[subprocess.Popen, int, typing.IO]] = {}
+    exit_codes: typing.Dict[str, int] = {}
+    free_cpus = cpus
+    while pending or running:
+        while pending:
+            trial_model_name, _ = pending[0]
+            trial_run = config.RunContext(task_name=task_name,
+                                          model_name=trial_model_name,
+                                          run_identifier=sweep_name,
+                                          model_configs_folder=model_configs_folder)
+            with open(trial_run.model_config_file()) as f:
+                cpus_needed = trial_cpus(json.load(f), cpus)
+            if cpus_needed > free_cpus:
+                break
+            pending.pop(0)
+            log_file = open(os.path.join(trial_run.data_folder(), "train.log"), "w")
+            process = subprocess.Popen([sys.executable, train_script, trial_model_name, "-r", sweep_name, "-mf", model_configs_folder] + train_arguments,
+                                       env=environment,
+                                       stdout=log_file,
+                                       stderr=subprocess.STDOUT)
+            print(f"started {trial_model_name} ({cpus_needed} cpus)")
+            running[trial_model_name] = (process, cpus_needed, log_file)
+            free_cpus -= cpus_needed
+
+        time.sleep(1)
+        for trial_model_name, (process, cpus_needed, log_file) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log_file.close()
+            exit_codes[trial_model_name] = process.returncode
+            print(f"finished {trial_model_name} (exit code {process.returncode})")
+            del running[trial_model_name]
+            free_cpus += cpus_needed
+    return exit_codes
+
+
+# dualevade trains one model per mouse, each with its own performance file
+performance_suffixes = {"dualevade": ["mouse_1", "mouse_2"]}
+
+
+def trial_performance(trial_run: config.RunContext) -> typing.Dict[str, typing.List[float]]:
+    performances = {}
+    for suffix in performance_suffixes.get(trial_run.task_name, [""]):
+        performance_file = trial_run.performance_file(suffix=suffix)
+        performances[suffix] = []
+        if os.path.exists(performance_file):
+            with open(performance_file) as f:
+                performances[suffix] = json.load(f)
+    return performances
+
+
+def summarize_sweep(task_name: str,
+                    sweep_name: str,
+                    trials: typing.List[typing.Tuple[str, dict]],
+                    exit_codes: typing.Optional[typing.Dict[str, int]] = None) -> typing.List[dict]:
+    """
+    Survival rates of every trial, best first. Trials with several performance files
+    (the mice of dualevade) are ranked by their weakest model: cycles, best and last
+    survival rates are the lowest among their performance files.
+    """
+    rows = []
+    for trial_model_name, parameters in trials:
+        trial_run = config.RunContext(task_name=task_name, model_name=trial_model_name, run_identifier=sweep_name)
+        performances = trial_performance(trial_run)
+        cycles = min(len(performance) for performance in performances.values())
+        row = {"trial": trial_model_name,
+               "parameters": parameters,
+               "cycles": cycles,
+               "best_survival_rate": min(max(performance) for performance in performances.values()) if cycles else None,
+               "last_survival_rate": min(performance[-1] for performance in performances.values()) if cycles else None,
+               "exit_code": exit_codes.get(trial_model_name) if exit_codes else None}
+        if len(performances) > 1:
+            row["best_survival_rates"] = {suffix: max(performance) if performance else None
+                                          for suffix, performance in performances.items()}
+        rows.append(row)
+    rows.sort(key=lambda row: -1 if row["best_survival_rate"] is None else row["best_survival_rate"], reverse=True)
+    return rows
+
+
+def print_summary(rows: typing.List[dict]):
+    parameter_names = sorted({name for row in rows for name in row["parameters"]})
+    header = ["trial"] + parameter_names + ["cycles", "best", "last"]
+    lines = [header]
+    for row in rows:
+        lines.append([row["trial"]] +
+                     [f"{row['parameters'].get(name, '')}" for name in parameter_names] +
+                     [f"{row['cycles']}",
+                      "-" if row["best_survival_rate"] is None else f"{row['best_survival_rate']:.3f}",
+                      "-" if row["last_survival_rate"] is None else f"{row['last_survival_rate']:.3f}"])
+    widths = [max(len(line[column]) for line in lines) for column in range(len(header))]
+    for line in lines:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_arguments()
+    except argparse.ArgumentError as e:
+        print("Error:", e)
+        exit(1)
+
+    sweep_name = args.sweep_name if args.sweep_name else config.new_run_identifier()
+    base_run = config.RunContext(task_name=args.task_name, model_name=args.model_name, run_identifier=sweep_name)
+
+    if not os.path.exists(base_run.model_config_file()):
+        print(f"Model configuration file '{base_run.model_config_file()}' not found")
+        exit(1)
+
+    if not os.path.exists(args.sweep_file):
+        print(f"Sweep file '{args.sweep_file}' not found")
+        exit(1)
+
+    with open(args.sweep_file) as f:
+        sweep = json.load(f)
+
+    sweep_folder = os.path.join("sweeps", args.task_name, f"{args.model_name}_{sweep_name}")
+    os.makedirs(sweep_folder, exist_ok=True)
+    trials_file = os.path.join(sweep_folder, "trials.json")
+    model_configs_folder = os.path.abspath(os.path.join(sweep_folder, "models"))
+
+    exit_codes = None
+    if args.summary_only:
+        with open(trials_file) as f:
+            trials = [(trial["trial"], trial["parameters"]) for trial in json.load(f)]
+    else:
+        trials = write_trials(task_name=args.task_name,
+                              model_name=args.model_name,
+                              sweep_name=sweep_name,
+                              sweep=sweep,
+                              seed=args.seed,
+                              model_configs_folder=model_configs_folder,
+                              pruning_reports_folder=os.path.join(sweep_folder, "pruning"))
+        with open(trials_file, 'w') as f:
+            json.dump([{"trial": trial_model_name, "parameters": parameters} for trial_model_name, parameters in trials], f, indent=1)
+        cpus = args.cpus if args.cpus else os.cpu_count()
+        print(f"sweep {sweep_name}: {len(trials)} trials on {cpus} cpus")
+        exit_codes = run_trials(task_name=args.task_name,
+                                sweep_name=sweep_name,
+                                trials=trials,
+                                model_configs_folder=model_configs_folder,
+                                cpus=cpus,
+                                train_arguments=args.train_arguments.split())
+
+    rows = summarize_sweep(args.task_name, sweep_name, trials, exit_codes)
+    with open(os.path.join(sweep_folder, "summary.json"), 'w') as f:
+        json.dump(rows, f, indent=1)
+    print_summary(rows)
@@ -1,4 +1,3 @@
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
 import cellworld_gym as cwg
 import gymnasium
 
@@ -11,17 +10,20 @@ def create_env(world_name: str = "21_05",
                reward_structure: dict = {},
                render: bool = False,
                real_time: bool = False,
+               share_world_assets: bool = False,
                **kwargs):
 
-    return gymnasium.make("CellworldBotEvade-v0",
-                          world_name=world_name,
-                          use_lppos=use_lppos,
-                          use_predator=use_predator,
-                          max_step=max_steps,
-                          time_step=time_step,
-                          reward_function=cwg.Reward(reward_structure),
-                          real_time=real_time,
-                          render=render)
+    import world_cache
+    with world_cache.shared_world_assets(share_world_assets):
+        return gymnasium.make("CellworldBotEvade-v0",
+                              world_name=world_name,
+                              use_lppos=use_lppos,
+                              use_predator=use_predator,
+                              max_step=max_steps,
+                              time_step=time_step,
+                              reward_function=cwg.Reward(reward_structure),
+                              real_time=real_time,
+                              render=render)
 
 
 def create_vec_env(environment_count: int,
@@ -31,13 +33,19 @@ def create_vec_env(environment_count: int,
                    max_steps: int = 300,
                    time_step: float = .25,
                    reward_structure: dict = {},
+                   vec_env_backend: str = "dummy",
+                   share_world_assets: bool = False,
                    **kwargs):
 
-    return DummyVecEnv([lambda:
-                        create_env(world_name=world_name,
-                                   use_lppos=use_lppos,
-                                   use_predator=use_predator,
-                                   max_steps=max_steps,
-                                   time_step=time_step,
-                                   reward_structure=reward_structure)
-                        for _ in range(environment_count)])
+    env_fns = [lambda:
+               create_env(world_name=world_name,
+                          use_lppos=use_lppos,
+                          use_predator=use_predator,
+                          max_steps=max_steps,
+                          time_step=time_step,
+                          reward_structure=reward_structure,
+                          share_world_assets=share_world_assets)
+               for _ in range(environment_count)]
+
+    import vec_env_backends
+    return vec_env_backends.create_vec_env(env_fns, vec_env_backend=vec_env_backend)
@@ -0,0 +1,70 @@
+import os
+import sys
+sys.path.append('../../')
+import json
+import argparse
+from algorightms import algorithms
+import config
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI evaluation tool: runs a trained RL model headless on vectorized Cellworld BotEvade environments')
+    parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
+    parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run')
+    parser.add_argument('-e', '--episode_count', type=int, default=1000, help='number of episodes to evaluate (default 1000)')
+    parser.add_argument('-c', '--cycle', type=int, help='model cycle')
+    parser.add_argument('-n', '--environment_count', type=int, help='number of environments (default from the model configuration)')
+    parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
+    parser.add_argument('-np', '--numpy_policy', type=str, choices=["float32", "float16", "int8"], help='runs the policy exported by export.py with this weight dtype')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_arguments()
+    except argparse.ArgumentError as e:
+        print("Error:", e)
+        exit(1)
+
+    run = config.RunContext(task_name="botevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
+    model_configuration_file = run.model_config_file()
+
+    if not os.path.exists(model_configuration_file):
+        print(f"Model configuration file '{model_configuration_file}' not found")
+        exit(1)
+
+    run_data_file = run.data_file()
+    performance_file = run.performance_file(suffix="evaluation")
+
+    if args.cycle:
+        run_data_file = run_data_file.replace(".zip", f"_{args.cycle}.zip")
+        performance_file = run.performance_file(suffix=f"evaluation_{args.cycle}")
+
+    if not os.path.exists(run_data_file):
+        print(f"Data file '{run_data_file}' not found")
+        exit(1)
+
+    model_config = json.loads(open(model_configuration_file).read())
+    from env import create_vec_env
+    from evaluation import evaluate, save_evaluation
+
+    if args.environment_count:
+        model_config["environment_count"] = args.environment_count
+
+    vec_envs = create_vec_env(use_lppos=args.tlppo,
+                              **model_config)
+
+    import inference
+    algorithm = algorithms[model_config["algorithm"]]
+    model = inference.load_policy(run_data_file, algorithm, args.numpy_policy)
+
+    episodes = evaluate(model=model,
+                        vec_env=vec_envs,
+                        episode_count=args.episode_count)
+    vec_envs.close()
+
+    summary = save_evaluation(episodes, performance_file)
+    print(f"survival rate {summary['survival_rate']:.3f} over {summary['episode_count']} episodes, saved to {performance_file}")
@@ -1,23 +1,20 @@
 import os
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 import typing
 import sys
 sys.path.append('../../')
 import json
 import argparse
-from env import create_vec_env
 from algorightms import algorithms
-from callback import CellworldCallback
+from checkpoint import CheckpointWriter
 import config
 
-config.task_name = "botevade"
-
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Cellworld AI BotEvade training tool: trains an RL model on the Cellworld BotEvade OpenAI Gym environment')
     parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
     parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run')
-    parser.add_argument('-b', '--replay_buffer_file', type=str, help='replay buffer file', required=False)
+    parser.add_argument('-mf', '--model_configs_folder', type=str, help='folder containing the model configuration file (default models/<task>)', required=False)
+    parser.add_argument('-b', '--replay_buffer_file', type=str, help='replay buffer file with demonstrations, sampled with the "demo_ratio" of the model configuration (default 0.25)', required=False)
     parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
     args = parser.parse_args()
     return args
@@ -30,11 +27,12 @@ if __name__ == "__main__":
         print("Error:", e)
         exit(1)
 
-    config.set_task("botevade")
-    config.set_model(args.model_name)
-    config.set_run_identifier(args.run_identifier)
+    run = config.RunContext(task_name="botevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier,
+                            model_configs_folder=args.model_configs_folder)
 
-    model_configuration_file = config.model_config_file()
+    model_configuration_file = run.model_config_file()
 
     if not os.path.exists(model_configuration_file):
         print(f"Model configuration file '{model_configuration_file}' not found")
@@ -42,21 +40,24 @@ if __name__ == "__main__":
 
     replay_buffer_file = ""
     if args.replay_buffer_file:
-        replay_buffer_file = config.in_buffer_file(replay_buffer_file=replay_buffer_file)
+        replay_buffer_file = run.in_buffer_file(replay_buffer_file=args.replay_buffer_file)
         if not os.path.exists(replay_buffer_file):
             print(f"Replay buffer file '{replay_buffer_file}' not found")
             exit(1)
 
     model_config = json.loads(open(model_configuration_file).read())
+    from env import create_vec_env
+    from callback import CellworldCallback, SurvivalPruningCallback
+    from replay_buffers import mix_demonstrations, save_memmap_buffer
 
-    run_replay_buffer_file = config.out_buffer_file()
-    run_data_file = config.data_file()
-    logs_folder = config.tensor_board_logs_folder()
+    run_replay_buffer_file = run.out_buffer_file()
+    run_data_file = run.data_file()
+    logs_folder = run.tensor_board_logs_folder()
     tlppo = True if args.tlppo else False
     vec_envs = create_vec_env(use_lppos=tlppo,
                               **model_config)
 
-    print("envs created: ", len(vec_envs.envs))
+    print("envs created: ", vec_envs.num_envs)
 
     algorithm = algorithms[model_config["algorithm"]]
 
@@ -64,7 +65,8 @@ if __name__ == "__main__":
         print(f"Data file '{run_data_file}' found, loading...")
         model = algorithm.load(env=vec_envs,
                                tensorboard_log=logs_folder,
-                               path=run_data_file)
+                               path=run_data_file,
+                               replay_buffer=model_config.get("replay_buffer", "default"))
         reset_num_time_steps = False
     else:
         print(f"Data file '{run_data_file}' not found")
@@ -75,40 +77,58 @@ if __name__ == "__main__":
 
     if args.replay_buffer_file:
         print(f"loading replay buffer file {replay_buffer_file}")
-        model.load_replay_buffer(replay_buffer_file)
+        mix_demonstrations(model, replay_buffer_file, demo_ratio=model_config.get("demo_ratio", 0.25))
 
     if "training_cycles" in model_config:
         training_cycles = model_config["training_cycles"]
     else:
         training_cycles = 1
 
-    callback = CellworldCallback()
+    callback = CellworldCallback(log_frequency=model_config.get("callback_log_frequency"))
+    callbacks = [callback]
+    pruning = None
+    if "pruning" in model_config:
+        pruning = SurvivalPruningCallback(cellworld_callback=callback,
+                                          trial_name=run.model_name,
+                                          verbose=1,
+                                          **model_config["pruning"])
+        callbacks.append(pruning)
 
     performance: typing.List[float] = []
-    performance_file = config.performance_file()
+    performance_file = run.performance_file()
 
     if os.path.exists(performance_file):
         with open(performance_file) as f:
             performance = json.load(f)
 
-    best_survival_rate = max(callback.survival)
+    best_survival_rate = max(performance) if performance else -0.1
     cycle_offset = len(performance)
 
+    checkpoints = CheckpointWriter()
+
     for cycle in range(training_cycles):
         model.learn(total_timesteps=model_config["training_steps"],
-                    callback=callback,
+                    callback=callbacks,
                     reset_num_timesteps=reset_num_time_steps)
         reset_num_time_steps = False
 
-        performance.append(callback.survival)
-        if callback.survival > best_survival_rate:
-            best_survival_rate = callback.survival
-            model.save(run_data_file.replace(".zip", f"_best.zip"))
+        performance.append(callback.current_survival)
+        with open(performance_file, 'w') as f:
+            json.dump(performance, f)
+        data_file_aliases = [run_data_file]
+        if callback.current_survival > best_survival_rate:
+            best_survival_rate = callback.current_survival
+            data_file_aliases.append(run_data_file.replace(".zip", f"_best.zip"))
 
         print(f"saving data file {run_data_file}")
-        model.save(run_data_file)
-        model.save(run_data_file.replace(".zip", f"_{cycle + cycle_offset}.zip"))
+        checkpoints.save(model, run_data_file.replace(".zip", f"_{cycle + cycle_offset}.zip"), *data_file_aliases)
+
+        if pruning is not None and pruning.pruned:
+            print(f"training stopped after {cycle + 1} cycles: {pruning.reason}")
+            break
+
+    checkpoints.close()
 
-    if hasattr(model, "save_replay_buffer"):
+    if hasattr(model, "replay_buffer"):
         print(f"saving replay buffer file {run_replay_buffer_file}")
-        model.save_replay_buffer(run_replay_buffer_file)
+        save_memmap_buffer(model.replay_buffer, run_replay_buffer_file)
@@ -1,13 +1,176 @@
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
+import os
+import math
+import time
+import typing
+import numpy as np
 import cellworld_gym as cwg
 import cellworld_belief as belief
 import gymnasium
 
 
-def get_belief_state_components(condition: int):
+class BeliefComponentTimer:
+    """
+    Accumulates the time each belief state component spends in the callbacks BeliefState.tick
+    and reset call on it, keyed by component class name.
+    """
+    hooks = ["on_reset",
+             "on_self_location_update",
+             "on_other_location_update",
+             "on_visibility_update",
+             "on_tick"]
+
+    def __init__(self):
+        self.times: typing.Dict[str, float] = {}
+        self.synchronize = False
+
+    def instrument(self, components: typing.List[belief.BeliefStateComponent]) -> typing.List[belief.BeliefStateComponent]:
+        import torch
+        # cuda kernels run asynchronously, wait for them or the time lands on the next component
+        self.synchronize = torch.cuda.is_available()
+        for component in components:
+            name = type(component).__name__
+            self.times.setdefault(name, 0.0)
+            for hook in self.hooks:
+                setattr(component, hook, self._timed(name, getattr(component, hook)))
+        return components
+
+    def _timed(self, name: str, method: typing.Callable) -> typing.Callable:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            if self.synchronize:
+                import torch
+                torch.cuda.synchronize()
+            self.times[name] += time.perf_counter() - start
+            return result
+        return timed
+
+    def pop(self) -> typing.Dict[str, float]:
+        times = dict(self.times)
+        for name in self.times:
+            self.times[name] = 0.0
+        return times
+
+
+class BeliefTimeInfo(gymnasium.Wrapper):
+    """
+    Adds the seconds spent in each belief component since the previous step to info["belief_time"].
+    """
+    def __init__(self, env: gymnasium.Env, timer: BeliefComponentTimer):
+        super().__init__(env)
+        self.timer = timer
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        info["belief_time"] = self.timer.pop()
+        return observation, reward, terminated, truncated, info
+
+
+visibility_tables: typing.Dict[str, np.ndarray] = {}
+
+
+def visibility_table(belief_state: belief.BeliefState) -> np.ndarray:
+    """
+    Bit packed matrix with one row per belief grid point: bit k of row s is set when grid point k
+    is inside the visibility polygon from grid point s. Built once per world and belief definition,
+    cached to disk and memory mapped, so all the envs of a machine share the same pages.
+    """
+    import config
+    world_name = belief_state.model.world_name
+    table_file = os.path.join(config.visibility_tables_folder(),
+                              f"{world_name}_{belief_state.shape[0]}x{belief_state.shape[1]}.npy")
+    if table_file in visibility_tables:
+        return visibility_tables[table_file]
+    if not os.path.exists(table_file):
+        points = belief_state.points
+        rows = []
+        for source in points.cpu().numpy():
+            polygon = belief_state.model.visibility.get_visibility_polygon(src=(float(source[0]), float(source[1])),
+                                                                           direction=0,
+                                                                           view_field=360)
+            rows.append(np.packbits(polygon.contains(points).cpu().numpy().astype(bool)))
+        temp_file = f"{table_file}.{os.getpid()}.tmp.npy"
+        np.save(temp_file, np.stack(rows))
+        os.replace(temp_file, table_file)
+    visibility_tables[table_file] = np.load(table_file, mmap_mode="r")
+    return visibility_tables[table_file]
+
+
+def grid_index(belief_state: belief.BeliefState, location) -> int:
+    """
+    Index of the belief grid point of the cell holding location. The grid points sit at the cell
+    centres min + (i + 0.5) * granularity, so the cell is the floor of the offset (the indices the
+    belief state hands to its components are rounded and point at the neighbouring cell half the time).
+    """
+    column = math.floor((location[0] - belief_state.min_x) / belief_state.granularity)
+    row = math.floor((location[1] - belief_state.min_y) / belief_state.granularity)
+    column = min(max(column, 0), belief_state.shape[1] - 1)
+    row = min(max(row, 0), belief_state.shape[0] - 1)
+    return row * belief_state.shape[1] + column
+
+
+def check_visibility_table(belief_state: belief.BeliefState, sample_count: int = 50, seed: int = 0) -> typing.List[int]:
+    """
+    Places the agent on sampled belief grid points and compares the visibility_table row the
+    VisibilityTableComponent would read against the visibility polygon test of VisibilityComponent,
+    and checks that locations around each grid point inside its cell map to the same row.
+
+    :return: grid points whose table mask differs from the polygon test
+    """
+    table = visibility_table(belief_state)
+    points = belief_state.points
+    generator = np.random.default_rng(seed)
+    mismatches = []
+    for index in generator.choice(belief_state.size, size=min(sample_count, belief_state.size), replace=False):
+        location = (float(points[index][0]), float(points[index][1]))
+        polygon = belief_state.model.visibility.get_visibility_polygon(src=location, direction=0, view_field=360)
+        in_view = polygon.contains(points).cpu().numpy().astype(bool)
+        table_in_view = np.unpackbits(table[grid_index(belief_state, location)], count=belief_state.size).astype(bool)
+        # any location inside the cell of the grid point reads the same row
+        offset = 0.45 * belief_state.granularity
+        cell_locations = [(location[0] + dx, location[1] + dy) for dx in (-offset, offset) for dy in (-offset, offset)]
+        same_row = all(grid_index(belief_state, cell_location) == index for cell_location in cell_locations)
+        if not same_row or not np.array_equal(in_view, table_in_view):
+            mismatches.append(int(index))
+    return mismatches
+
+
+class VisibilityTableComponent(belief.VisibilityComponent):
+    """
+    VisibilityComponent that looks the agent view up in the precomputed visibility_table (agent
+    location snapped to the grid point of its cell) instead of testing every grid point against the
+    visibility polygon each step. Agents with a view field narrower than 360 degrees depend on
+    their direction and fall back to the polygon test.
+    """
+    def __init__(self):
+        belief.VisibilityComponent.__init__(self)
+        self.table: typing.Optional[np.ndarray] = None
+        self.self_index = 0
+
+    def on_belief_state_set(self, belief_state: belief.BeliefState):
+        if belief_state.agent.view_field >= 360:
+            self.table = visibility_table(belief_state)
+
+    def on_self_location_update(self,
+                                self_location,
+                                self_indices: typing.Tuple[int, int],
+                                time_step: int) -> None:
+        self.self_index = grid_index(self.belief_state, self_location)
+
+    def predict(self, probability_distribution, time_step: int) -> None:
+        if self.table is None:
+            return belief.VisibilityComponent.predict(self, probability_distribution, time_step)
+        if self.visibility_update_time_step == time_step and self.other_location_update_time_step != time_step:
+            import torch
+            in_view = np.unpackbits(self.table[self.self_index], count=self.belief_state.size).astype(bool)
+            in_view_matrix = torch.from_numpy(in_view).reshape(self.belief_state.shape).to(self.belief_state.device)
+            probability_distribution[in_view_matrix] = 0
+
+
+def get_belief_state_components(condition: int, use_visibility_table: bool = False):
     NB = belief.NoBeliefComponent()
     LOS = belief.LineOfSightComponent(other_scale=.5)
-    V = belief.VisibilityComponent()
+    V = VisibilityTableComponent() if use_visibility_table else belief.VisibilityComponent()
     D = belief.DiffusionComponent()
     GD = belief.GaussianDiffusionComponent()
     DD = belief.DirectedDiffusionComponent()
@@ -42,18 +205,32 @@ def create_env(world_name: str = "21_05",
                reward_structure: dict = {},
                render: bool = False,
                real_time: bool = False,
+               profile_belief: bool = False,
+               use_visibility_table: bool = False,
+               share_world_assets: bool = False,
                **kwargs):
 
-    return gymnasium.make("CellworldBotEvadeBelief-v0",
-                          world_name=world_name,
-                          use_lppos=use_lppos,
-                          use_predator=use_predator,
-                          max_step=max_steps,
-                          time_step=time_step,
-                          reward_function=reward_function,
-                          real_time=real_time,
-                          render=render,
-                          belief_state_components=get_belief_state_components(condition=condition))
+    components = get_belief_state_components(condition=condition, use_visibility_table=use_visibility_table)
+    timer = None
+    if profile_belief:
+        timer = BeliefComponentTimer()
+        timer.instrument(components)
+
+    import world_cache
+    with world_cache.shared_world_assets(share_world_assets):
+        env = gymnasium.make("CellworldBotEvadeBelief-v0",
+                             world_name=world_name,
+                             use_lppos=use_lppos,
+                             use_predator=use_predator,
+                             max_step=max_steps,
+                             time_step=time_step,
+                             reward_function=reward_function,
+                             real_time=real_time,
+                             render=render,
+                             belief_state_components=components)
+    if timer is not None:
+        env = BeliefTimeInfo(env, timer)
+    return env
 
 
 def create_vec_env(environment_count: int,
@@ -64,14 +241,33 @@ def create_vec_env(environment_count: int,
                    condition: int = 1,
                    max_steps: int = 300,
                    time_step: float = .25,
+                   vec_env_backend: str = "dummy",
+                   profile_belief: bool = False,
+                   use_visibility_table: bool = False,
+                   share_world_assets: bool = False,
                    **kwargs):
 
-    return DummyVecEnv([lambda:
-                        create_env(world_name=world_name,
-                                   use_lppos=use_lppos,
-                                   use_predator=use_predator,
-                                   condition=condition,
-                                   max_steps=max_steps,
-                                   time_step=time_step,
-                                   reward_function=reward_function)
-                        for _ in range(environment_count)])
+    env_fns = [lambda:
+               create_env(world_name=world_name,
+                          use_lppos=use_lppos,
+                          use_predator=use_predator,
+                          condition=condition,
+                          max_steps=max_steps,
+                          time_step=time_step,
+                          reward_function=reward_function,
+                          profile_belief=profile_belief,
+                          use_visibility_table=use_visibility_table,
+                          share_world_assets=share_world_assets)
+               for _ in range(environment_count)]
+
+    import vec_env_backends
+    return vec_env_backends.create_vec_env(env_fns, vec_env_backend=vec_env_backend)
+
+
+if __name__ == "__main__":
+    env = create_env(use_lppos=False, use_predator=True, condition=5, use_visibility_table=True)
+    env.reset(seed=0)
+    mismatches = check_visibility_table(env.unwrapped.belief_state)
+    print(f"visibility table mismatches: {mismatches}")
+    assert not mismatches
+    env.close()
@@ -1,13 +1,9 @@
 import os
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 import json
 import argparse
-from tasks.botevade.env import create_env
 from algorightms import algorithms
 import config
 
-config.task_name = "botevade"
-
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Cellworld AI visualization tool: executes a trained RL model on a Cellworld OpenAI Gym environment')
@@ -19,6 +15,7 @@ def parse_arguments():
     parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
     parser.add_argument('-s', '--silent', action='store_true', help='renders the environment to the screen')
     parser.add_argument('-rt', '--real_time', action='store_true', help='run_in_real_time')
+    parser.add_argument('-np', '--numpy_policy', type=str, choices=["float32", "float16", "int8"], help='runs the policy exported by export.py with this weight dtype')
 
     args = parser.parse_args()
     if args.video and args.silent:
@@ -34,10 +31,10 @@ if __name__ == "__main__":
         print("Error:", e)
         exit(1)
 
-    config.set_task("botevade")
-    config.set_model(args.model_name)
-    config.set_run_identifier(args.run_identifier)
-    model_configuration_file = config.model_config_file()
+    run = config.RunContext(task_name="botevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
+    model_configuration_file = run.model_config_file()
 
     if not os.path.exists(model_configuration_file):
         print(f"Model configuration file '{model_configuration_file}' not found")
@@ -45,7 +42,7 @@ if __name__ == "__main__":
     else:
         print(f"Model configuration file '{model_configuration_file}' found")
 
-    run_data_file = config.data_file()
+    run_data_file = run.data_file()
 
     if args.cycle:
         run_data_file = run_data_file.replace(".zip", f"_{args.cycle}.zip")
@@ -57,17 +54,19 @@ if __name__ == "__main__":
         print(f"Data file '{run_data_file}' found")
 
     model_config = json.loads(open(model_configuration_file).read())
+    from tasks.botevade.env import create_env
 
     environment = create_env(use_lppos=args.tlppo,
                              render=not args.silent,
                              real_time=args.real_time,
                              **model_config)
 
+    import inference
     algorithm = algorithms[model_config["algorithm"]]
-    model = algorithm.load(run_data_file)
+    model = inference.load_policy(run_data_file, algorithm, args.numpy_policy)
 
     if args.video:
-        videos_folder = config.video_folder()
+        videos_folder = run.video_folder()
         print(f"Saving videos to {videos_folder}")
         from cellworld_game import save_video_output
         save_video_output(environment.model,
@@ -1,7 +1,13 @@
 import gym
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+import numpy as np
 import cellworld_gym as cwg
 import gymnasium
+from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
+import vec_env_backends
 
 
 def create_env(world_name: str = "21_05",
@@ -14,20 +20,23 @@ def create_env(world_name: str = "21_05",
                render: bool = False,
                real_time: bool = False,
                end_on_pov_goal: bool = True,
+               share_world_assets: bool = False,
                **kwargs) -> cwg.DualEvadeEnv:
 
-    env_ = gymnasium.make("CellworldDualEvade-v0",
-                          world_name=world_name,
-                          use_lppos=use_lppos,
-                          use_other=use_other,
-                          use_predator=use_predator,
-                          max_step=max_steps,
-                          time_step=time_step,
-                          reward_function=cwg.Reward(reward_structure),
-                          real_time=real_time,
-                          render=render,
-                          end_on_pov_goal=end_on_pov_goal
-                          )
+    import world_cache
+    with world_cache.shared_world_assets(share_world_assets):
+        env_ = gymnasium.make("CellworldDualEvade-v0",
+                              world_name=world_name,
+                              use_lppos=use_lppos,
+                              use_other=use_other,
+                              use_predator=use_predator,
+                              max_step=max_steps,
+                              time_step=time_step,
+                              reward_function=cwg.Reward(reward_structure),
+                              real_time=real_time,
+                              render=render,
+                              end_on_pov_goal=end_on_pov_goal
+                              )
     if use_other:
         print(f"Including other agent info in the observation: {type(env_.observation)}")
     else:
@@ -44,17 +53,24 @@ def create_vec_env(environment_count: int,
                    max_steps: int = 300,
                    time_step: float = .25,
                    reward_structure: dict = {},
+                   vec_env_backend: str = "dummy",
+                   share_world_assets: bool = False,
                    **kwargs):
 
-    return DummyVecEnv([lambda:
-                        create_env(world_name=world_name,
-                                   use_lppos=use_lppos,
-                                   use_other=use_other,
-                                   use_predator=use_predator,
-                                   max_steps=max_steps,
-                                   time_step=time_step,
-                                   reward_structure=reward_structure)
-                        for _ in range(environment_count)])
+    env_fns = [lambda:
+               create_env(world_name=world_name,
+                          use_lppos=use_lppos,
+                          use_other=use_other,
+                          use_predator=use_predator,
+                          max_steps=max_steps,
+                          time_step=time_step,
+                          reward_structure=reward_structure,
+                          share_world_assets=share_world_assets)
+               for _ in range(environment_count)]
+
+    if vec_env_backend == "dummy":
+        return OtherPolicyVecEnv(env_fns)
+    return vec_env_backends.create_vec_env(env_fns, vec_env_backend=vec_env_backend)
 
 
 def load_vec_env(environment_count: int,
@@ -65,20 +81,181 @@ def load_vec_env(environment_count: int,
                  max_steps: int = 300,
                  time_step: float = .25,
                  reward_structure: dict = {},
+                 vec_env_backend: str = "dummy",
+                 share_world_assets: bool = False,
                  **kwargs):
 
-    return DummyVecEnv([lambda:
-                        create_env(world_name=world_name,
-                                   use_lppos=use_lppos,
-                                   use_other=use_other,
-                                   use_predator=use_predator,
-                                   max_steps=max_steps,
-                                   time_step=time_step,
-                                   reward_structure=reward_structure)
-                        for _ in range(environment_count)])
+    env_fns = [lambda:
+               create_env(world_name=world_name,
+                          use_lppos=use_lppos,
+                          use_other=use_other,
+                          use_predator=use_predator,
+                          max_steps=max_steps,
+                          time_step=time_step,
+                          reward_structure=reward_structure,
+                          share_world_assets=share_world_assets)
+               for _ in range(environment_count)]
+
+    if vec_env_backend == "dummy":
+        return OtherPolicyVecEnv(env_fns)
+    return vec_env_backends.create_vec_env(env_fns, vec_env_backend=vec_env_backend)
+
+
+class OtherPolicy:
+    """
+    Deterministic inference for the other agent: a batch of observations goes through the
+    policy in a single forward pass without gradients, optionally through a TorchScript trace.
+    """
+    def __init__(self, model, compile: bool = False):
+        self.model = model
+        # numpy policies exported by inference.py have no torch module to trace
+        self.compile = compile and hasattr(model, "policy")
+        self.traced = None
+
+    def _trace(self, observations: np.ndarray):
+        import torch
 
+        class DeterministicPolicy(torch.nn.Module):
+            def __init__(self, policy):
+                super().__init__()
+                self.policy = policy
 
-def set_other_policy(vec_env, model):
+            def forward(self, observation):
+                return self.policy._predict(observation, deterministic=True)
+
+        policy = self.model.policy
+        policy.set_training_mode(False)
+        observation_tensor, _ = policy.obs_to_tensor(observations)
+        try:
+            with torch.no_grad():
+                self.traced = torch.jit.trace(DeterministicPolicy(policy), observation_tensor, check_trace=False)
+        except (RuntimeError, TypeError) as e:
+            print(f"other agent policy could not be compiled, running it eagerly: {e}")
+            self.compile = False
+
+    def predict(self, observations: np.ndarray) -> np.ndarray:
+        if self.compile and self.traced is None:
+            self._trace(observations)
+        if not self.compile:
+            actions, _states = self.model.predict(observations, deterministic=True)
+            return actions
+        import torch
+        observation_tensor, _ = self.model.policy.obs_to_tensor(observations)
+        with torch.no_grad():
+            actions = self.traced(observation_tensor)
+        return actions.cpu().numpy().reshape((-1,) + self.model.action_space.shape)
+
+
+class OtherPolicyBatcher:
+    """
+    Rendezvous for the other agent policy calls made by envs stepping on separate threads:
+    once every env still stepping is waiting for an action, all their observations are
+    answered with a single batched prediction. When the prediction raises, the error is
+    raised in every waiting env thread so the step fails instead of waiting forever.
+    """
+    def __init__(self, other_policy: OtherPolicy):
+        self.other_policy = other_policy
+        self.condition = threading.Condition()
+        self.active = 0
+        self.pending: typing.Dict[int, np.ndarray] = {}
+        self.actions: typing.Dict[int, np.ndarray] = {}
+        self.next_ticket = 0
+        self.error: typing.Optional[BaseException] = None
+
+    def begin(self, env_count: int):
+        with self.condition:
+            self.active = env_count
+            self.pending = {}
+            self.actions = {}
+            self.error = None
+
+    def end(self):
+        with self.condition:
+            self.active -= 1
+            self._predict_pending()
+
+    def __call__(self, observation: cwg.DualEvadeObservation):
+        observation = np.asarray(observation, dtype=np.float32)
+        with self.condition:
+            if self.active == 0:
+                # called outside a batched step (e.g. reset)
+                return self.other_policy.predict(observation[np.newaxis])[0]
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.pending[ticket] = observation
+            self._predict_pending()
+            while ticket not in self.actions and self.error is None:
+                self.condition.wait()
+            if ticket not in self.actions:
+                raise self.error
+            return self.actions.pop(ticket)
+
+    def _predict_pending(self):
+        if self.error is not None or not self.pending or len(self.pending) < self.active:
+            return
+        tickets = list(self.pending)
+        observations = np.stack([self.pending[ticket] for ticket in tickets])
+        self.pending = {}
+        try:
+            actions = self.other_policy.predict(observations)
+        except BaseException as error:
+            self.error = error
+            self.condition.notify_all()
+            raise
+        for ticket, action in zip(tickets, actions):
+            self.actions[ticket] = action
+        self.condition.notify_all()
+
+
+class OtherPolicyVecEnv(DummyVecEnv):
+    """
+    DummyVecEnv that steps its envs on threads once an other agent policy is set,
+    so the other agent actions of all the envs are computed in one forward pass per step.
+    """
+    def __init__(self, env_fns: typing.List[typing.Callable[[], gymnasium.Env]]):
+        super().__init__(env_fns)
+        self.batcher: typing.Optional[OtherPolicyBatcher] = None
+        self.executor: typing.Optional[ThreadPoolExecutor] = None
+
+    def set_other_policy(self, other_policy: OtherPolicy):
+        self.batcher = OtherPolicyBatcher(other_policy)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.num_envs)
+        for env in self.envs:
+            env.set_other_policy(self.batcher)
+
+    def _step_env(self, env_idx: int):
+        try:
+            obs, self.buf_rews[env_idx], terminated, truncated, self.buf_infos[env_idx] = self.envs[env_idx].step(
+                self.actions[env_idx]
+            )
+            self.buf_dones[env_idx] = terminated or truncated
+            self.buf_infos[env_idx]["TimeLimit.truncated"] = truncated and not terminated
+            if self.buf_dones[env_idx]:
+                self.buf_infos[env_idx]["terminal_observation"] = obs
+                obs, self.reset_infos[env_idx] = self.envs[env_idx].reset()
+            self._save_obs(env_idx, obs)
+        finally:
+            self.batcher.end()
+
+    def step_wait(self):
+        if self.batcher is None:
+            return super().step_wait()
+        self.batcher.begin(self.num_envs)
+        list(self.executor.map(self._step_env, range(self.num_envs)))
+        return self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        super().close()
+
+
+def set_other_policy(vec_env, model, compile: bool = False):
+
+    if isinstance(vec_env, OtherPolicyVecEnv):
+        vec_env.set_other_policy(OtherPolicy(model, compile=compile))
+        return
 
     def other_policy(obs: cwg.DualEvadeObservation) -> int:
         action, _states = model.predict(obs, deterministic=True)
@@ -87,6 +264,8 @@ def set_other_policy(vec_env, model):
     if hasattr(vec_env, "envs"):
         for env in vec_env.envs:
             env.set_other_policy(other_policy)
+    elif hasattr(vec_env, "num_envs"):
+        # the policy closure holds the live model, it cannot be shipped to worker processes
+        raise ValueError("set_other_policy requires the 'dummy' vec_env_backend")
     else:
         vec_env.set_other_policy(other_policy)
-
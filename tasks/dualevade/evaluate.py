@@ -0,0 +1,84 @@
+import os
+import sys
+sys.path.append('../../')
+import json
+import argparse
+from algorightms import algorithms
+import config
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Cellworld AI evaluation tool: runs trained RL models headless on vectorized Cellworld DualEvade environments')
+    parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
+    parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run')
+    parser.add_argument('-r1', '--run_identifier_1', type=str, help='string identifying the run for mouse 1')
+    parser.add_argument('-r2', '--run_identifier_2', type=str, help='string identifying the run for mouse 2')
+    parser.add_argument('-e', '--episode_count', type=int, default=1000, help='number of episodes to evaluate (default 1000)')
+    parser.add_argument('-c', '--cycle', type=int, help='model cycle')
+    parser.add_argument('-n', '--environment_count', type=int, help='number of environments (default from the model configuration)')
+    parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
+    parser.add_argument('-o', '--other', action='store_true', help='include information about the other agent in observation')
+    parser.add_argument('-np', '--numpy_policy', type=str, choices=["float32", "float16", "int8"], help='runs the policy exported by export.py with this weight dtype')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_arguments()
+    except argparse.ArgumentError as e:
+        print("Error:", e)
+        exit(1)
+
+    run = config.RunContext(task_name="dualevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
+
+    model_configuration_file = run.model_config_file()
+
+    if not os.path.exists(model_configuration_file):
+        print(f"Model configuration file '{model_configuration_file}' not found")
+        exit(1)
+
+    run_data_file_1 = run.with_run_identifier(args.run_identifier_1).data_file(suffix="mouse_1_best")
+    run_data_file_2 = run.with_run_identifier(args.run_identifier_2).data_file(suffix="mouse_2_best")
+    performance_file = run.performance_file(suffix="evaluation")
+
+    if args.cycle:
+        run_data_file_1 = run_data_file_1.replace(".zip", f"_{args.cycle}.zip")
+        run_data_file_2 = run_data_file_2.replace(".zip", f"_{args.cycle}.zip")
+        performance_file = run.performance_file(suffix=f"evaluation_{args.cycle}")
+
+    for run_data_file in [run_data_file_1, run_data_file_2]:
+        if not os.path.exists(run_data_file):
+            print(f"Data file '{run_data_file}' not found")
+            exit(1)
+
+    model_config = json.loads(open(model_configuration_file).read())
+    from env import create_vec_env, set_other_policy
+    from evaluation import evaluate, save_evaluation
+
+    if args.environment_count:
+        model_config["environment_count"] = args.environment_count
+
+    # the other mouse policy runs in process
+    model_config["vec_env_backend"] = "dummy"
+
+    vec_envs = create_vec_env(use_lppos=args.tlppo,
+                              use_other=args.other,
+                              **model_config)
+
+    import inference
+    algorithm = algorithms[model_config["algorithm"]]
+    model_1 = inference.load_policy(run_data_file_1, algorithm, args.numpy_policy)
+    model_2 = inference.load_policy(run_data_file_2, algorithm, args.numpy_policy)
+
+    set_other_policy(vec_env=vec_envs, model=model_2)
+
+    episodes = evaluate(model=model_1,
+                        vec_env=vec_envs,
+                        episode_count=args.episode_count)
+    vec_envs.close()
+
+    summary = save_evaluation(episodes, performance_file)
+    print(f"survival rate {summary['survival_rate']:.3f} over {summary['episode_count']} episodes, saved to {performance_file}")
@@ -0,0 +1,269 @@
+import os
+import time
+import typing
+import argparse
+import json
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from env import create_vec_env, set_other_policy
+from algorightms import algorithms
+from callback import CellworldCallback
+from checkpoint import CheckpointWriter
+from replay_buffers import mix_demonstrations, save_memmap_buffer
+import config
+
+
+class OpponentWeights:
+    """
+    Policy parameters of both mice in shared memory: each learner publishes its own
+    parameters to its slot and loads the other mouse slot into its opponent model.
+    """
+    def __init__(self, slots, locks, versions):
+        self.slots = slots
+        self.locks = locks
+        self.versions = versions
+        self.pulled_versions = {mouse: -1 for mouse in slots}
+
+    def publish(self, mouse: int, policy):
+        from torch.nn.utils import parameters_to_vector
+        vector = parameters_to_vector(policy.parameters()).detach().cpu().numpy()
+        with self.locks[mouse]:
+            self.slots[mouse][:] = vector
+            self.versions[mouse].value += 1
+
+    def pull(self, mouse: int, policy) -> bool:
+        import torch
+        from torch.nn.utils import vector_to_parameters
+        with self.locks[mouse]:
+            version = self.versions[mouse].value
+            if version == self.pulled_versions[mouse]:
+                return False
+            vector = torch.as_tensor(self.slots[mouse].copy(), device=policy.device)
+        with torch.no_grad():
+            vector_to_parameters(vector, policy.parameters())
+        self.pulled_versions[mouse] = version
+        return True
+
+
+class OpponentSyncCallback(BaseCallback):
+    def __init__(self, weights: OpponentWeights, mouse: int, opponent, sync_steps: int, verbose=0):
+        super(OpponentSyncCallback, self).__init__(verbose)
+        self.weights = weights
+        self.mouse = mouse
+        self.other_mouse = 3 - mouse
+        self.opponent = opponent
+        self.sync_steps = sync_steps
+
+    def _on_step(self):
+        if self.n_calls % self.sync_steps == 0:
+            self.weights.publish(self.mouse, self.model.policy)
+            self.weights.pull(self.other_mouse, self.opponent.policy)
+        return True
+
+
+# seconds a learner waits for the other one at the end of a cycle, a learner that dies
+# without aborting the barrier (e.g. killed by the OOM killer) fails the run after this long
+default_barrier_timeout = 3600
+
+
+def concurrent_learner(mouse: int,
+                       args: argparse.Namespace,
+                       run: config.RunContext,
+                       model_config: dict,
+                       connection,
+                       barrier,
+                       locks,
+                       versions):
+    try:
+        learn_concurrently(mouse, args, run, model_config, connection, barrier, locks, versions)
+    except BaseException:
+        # releases the other learner from the barrier instead of leaving it waiting forever
+        barrier.abort()
+        raise
+
+
+def learn_concurrently(mouse: int,
+                       args: argparse.Namespace,
+                       run: config.RunContext,
+                       model_config: dict,
+                       connection,
+                       barrier,
+                       locks,
+                       versions):
+    from multiprocessing import shared_memory
+    other_mouse = 3 - mouse
+    barrier_timeout = model_config.get("barrier_timeout", default_barrier_timeout)
+
+    run_replay_buffer_file = run.out_buffer_file(suffix=f"mouse_{mouse}")
+    run_data_file = run.data_file(suffix=f"mouse_{mouse}")
+    logs_folder = run.tensor_board_logs_folder(suffix=f"mouse_{mouse}")
+
+    vec_envs = create_vec_env(use_lppos=args.tlppo,
+                              use_other=args.other,
+                              **model_config)
+
+    print(f"Mouse {mouse} envs created: ", vec_envs.num_envs)
+
+    algorithm = algorithms[model_config["algorithm"]]
+
+    if os.path.exists(run_data_file):
+        print(f"Data file '{run_data_file}' found, loading...")
+        model = algorithm.load(env=vec_envs,
+                               tensorboard_log=logs_folder,
+                               path=run_data_file,
+                               replay_buffer=model_config.get("replay_buffer", "default"))
+        reset_num_time_steps = False
+    else:
+        print(f"Data file '{run_data_file}' not found")
+        model = algorithm.create(environment=vec_envs,
+                                 tensorboard_log=logs_folder,
+                                 **model_config)
+        reset_num_time_steps = True
+
+    if args.replay_buffer_file:
+        replay_buffer_file = run.in_buffer_file(replay_buffer_file=args.replay_buffer_file)
+        print(f"Mouse {mouse} loading replay buffer file {replay_buffer_file}")
+        mix_demonstrations(model, replay_buffer_file, demo_ratio=model_config.get("demo_ratio", 0.25))
+
+    # inference only copy of the other mouse, its weights come from the other learner
+    # before the first step, so it is built with the smallest replay buffer
+    opponent = algorithm.create(environment=vec_envs,
+                                tensorboard_log=None,
+                                **dict(model_config, buffer_size=1))
+
+    set_other_policy(vec_env=vec_envs, model=opponent, compile=model_config.get("compile_other_policy", False))
+
+    parameter_count = sum(parameter.numel() for parameter in model.policy.parameters())
+    connection.send(parameter_count)
+    slot_names = connection.recv()
+    memories = {slot_mouse: shared_memory.SharedMemory(name=name) for slot_mouse, name in slot_names.items()}
+    slots = {slot_mouse: np.ndarray((parameter_count,), dtype=np.float32, buffer=memory.buf) for slot_mouse, memory in memories.items()}
+    weights = OpponentWeights(slots=slots, locks=locks, versions=versions)
+
+    weights.publish(mouse, model.policy)
+    barrier.wait(timeout=barrier_timeout)
+    weights.pull(other_mouse, opponent.policy)
+
+    callback = CellworldCallback(log_frequency=model_config.get("callback_log_frequency"))
+    callbacks = [callback]
+    if model_config.get("opponent_sync_steps"):
+        callbacks.append(OpponentSyncCallback(weights=weights,
+                                              mouse=mouse,
+                                              opponent=opponent,
+                                              sync_steps=model_config["opponent_sync_steps"]))
+
+    performance: typing.List[float] = []
+    best_survival_rate = -0.1
+    performance_file = run.performance_file(suffix=f"mouse_{mouse}")
+
+    if os.path.exists(performance_file):
+        with open(performance_file, 'r') as f:
+            performance = json.load(f)
+        best_survival_rate = max(performance)
+
+    cycle_offset = len(performance)
+
+    checkpoints = CheckpointWriter()
+
+    for cycle in range(model_config["training_cycles"]):
+        model.learn(total_timesteps=model_config["training_steps"],
+                    log_interval=model_config["log_interval"],
+                    callback=callbacks,
+                    reset_num_timesteps=reset_num_time_steps)
+
+        reset_num_time_steps = False
+
+        # both learners finish the cycle before swapping opponents
+        weights.publish(mouse, model.policy)
+        barrier.wait(timeout=barrier_timeout)
+        weights.pull(other_mouse, opponent.policy)
+        barrier.wait(timeout=barrier_timeout)
+
+        data_file_aliases = [run_data_file]
+        if callback.current_survival > best_survival_rate:
+            best_survival_rate = callback.current_survival
+            data_file_aliases.append(run.data_file(suffix=f"mouse_{mouse}", cycle="best"))
+
+        print(f"saving data file {run_data_file}")
+        checkpoints.save(model, run.data_file(suffix=f"mouse_{mouse}", cycle=f"{cycle + cycle_offset:03}"), *data_file_aliases)
+
+        performance.append(callback.current_survival)
+        with open(performance_file, 'w') as f:
+            json.dump(performance, f)
+
+    checkpoints.close()
+
+    if hasattr(model, "replay_buffer"):
+        print(f"saving replay buffer file {run_replay_buffer_file}")
+        save_memmap_buffer(model.replay_buffer, run_replay_buffer_file)
+
+    del slots
+    for memory in memories.values():
+        memory.close()
+    vec_envs.close()
+
+
+def failed_learners(learners: dict) -> typing.List[int]:
+    return [mouse for mouse, learner in learners.items() if learner.exitcode not in (None, 0)]
+
+
+def stop_learners(learners: dict, barrier) -> None:
+    barrier.abort()
+    for learner in learners.values():
+        if learner.is_alive():
+            learner.terminate()
+    for learner in learners.values():
+        learner.join()
+
+
+def receive(connection, learners: dict, barrier):
+    # a learner that dies before answering would leave a blocking recv waiting forever
+    while not connection.poll(1):
+        if not all(learner.is_alive() for learner in learners.values()):
+            stop_learners(learners, barrier)
+            raise RuntimeError(f"concurrent learners failed before starting: exit codes {[learner.exitcode for learner in learners.values()]}")
+    return connection.recv()
+
+
+def train_concurrent(args: argparse.Namespace, run: config.RunContext, model_config: dict):
+    import multiprocessing
+    from multiprocessing import shared_memory
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(2)
+    locks = {mouse: ctx.Lock() for mouse in (1, 2)}
+    versions = {mouse: ctx.Value('i', 0) for mouse in (1, 2)}
+    connections = {}
+    learners = {}
+    for mouse in (1, 2):
+        connection, learner_connection = ctx.Pipe()
+        learner = ctx.Process(target=concurrent_learner,
+                              args=(mouse, args, run, model_config, learner_connection, barrier, locks, versions))
+        learner.start()
+        connections[mouse] = connection
+        learners[mouse] = learner
+
+    parameter_counts = {mouse: receive(connection, learners, barrier) for mouse, connection in connections.items()}
+    if parameter_counts[1] != parameter_counts[2]:
+        stop_learners(learners, barrier)
+        raise ValueError(f"mouse policies do not match: {parameter_counts[1]} and {parameter_counts[2]} parameters")
+    memories = {mouse: shared_memory.SharedMemory(create=True, size=parameter_counts[mouse] * np.dtype(np.float32).itemsize)
+                for mouse in (1, 2)}
+    try:
+        for connection in connections.values():
+            connection.send({mouse: memory.name for mouse, memory in memories.items()})
+        while any(learner.is_alive() for learner in learners.values()):
+            if failed_learners(learners):
+                stop_learners(learners, barrier)
+                break
+            time.sleep(1)
+        for learner in learners.values():
+            learner.join()
+    finally:
+        for memory in memories.values():
+            memory.close()
+            memory.unlink()
+
+    failed = failed_learners(learners)
+    if failed:
+        raise RuntimeError("concurrent learners failed: " +
+                           ", ".join(f"mouse {mouse} exit code {learners[mouse].exitcode}" for mouse in failed))
@@ -1,11 +1,8 @@
 import os
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 import json
 import argparse
-from env import create_env, set_other_policy
 from algorightms import algorithms
 import config
-config.task_name = "dualevade"
 
 
 def parse_arguments():
@@ -22,6 +19,7 @@ def parse_arguments():
     parser.add_argument('-s', '--silent', action='store_true', help='renders the environment to the screen')
     parser.add_argument('-el', '--experiment_log', action='store_true', help='generate experiment logs')
     parser.add_argument('-rt', '--real_time', action='store_true', help='run_in_real_time')
+    parser.add_argument('-np', '--numpy_policy', type=str, choices=["float32", "float16", "int8"], help='runs the policy exported by export.py with this weight dtype')
 
     args = parser.parse_args()
     if args.video and args.silent:
@@ -37,10 +35,11 @@ if __name__ == "__main__":
         print("Error:", e)
         exit(1)
 
-    config.set_task("dualevade")
-    config.set_model(args.model_name)
+    run = config.RunContext(task_name="dualevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
 
-    model_configuration_file = config.model_config_file()
+    model_configuration_file = run.model_config_file()
 
     if not os.path.exists(model_configuration_file):
         print(f"Model configuration file '{model_configuration_file}' not found")
@@ -48,17 +47,13 @@ if __name__ == "__main__":
     else:
         print(f"Model configuration file '{model_configuration_file}' found")
 
-    config.set_run_identifier(args.run_identifier_1)
-    run_data_file_1 = config.data_file(suffix="mouse_1_best")
-    config.set_run_identifier(args.run_identifier_2)
-    run_data_file_2 = config.data_file(suffix="mouse_2_best")
-    config.set_run_identifier(args.run_identifier)
+    run_data_file_1 = run.with_run_identifier(args.run_identifier_1).data_file(suffix="mouse_1_best")
+    run_data_file_2 = run.with_run_identifier(args.run_identifier_2).data_file(suffix="mouse_2_best")
 
     if args.cycle:
         run_data_file_1 = run_data_file_1.replace(".zip", f"_{args.cycle}.zip")
         run_data_file_2 = run_data_file_2.replace(".zip", f"_{args.cycle}.zip")
 
-
     if not os.path.exists(run_data_file_1):
         print(f"Data file '{run_data_file_1}' not found")
         exit(1)
@@ -72,6 +67,7 @@ if __name__ == "__main__":
         print(f"Data file '{run_data_file_2}' found")
 
     model_config = json.loads(open(model_configuration_file).read())
+    from env import create_env, set_other_policy
 
     environment = create_env(use_lppos=args.tlppo,
                              use_other=args.other,
@@ -80,26 +76,27 @@ if __name__ == "__main__":
                              end_on_pov_goal=False,
                              **model_config)
 
+    import inference
     algorithm = algorithms[model_config["algorithm"]]
-    model_1 = algorithm.load(run_data_file_1)
-    model_2 = algorithm.load(run_data_file_2)
+    model_1 = inference.load_policy(run_data_file_1, algorithm, args.numpy_policy)
+    model_2 = inference.load_policy(run_data_file_2, algorithm, args.numpy_policy)
 
     set_other_policy(vec_env=environment, model=model_2)
 
     if args.video:
-        videos_folder = config.video_folder()
+        videos_folder = run.video_folder()
         print(f"Saving videos to {videos_folder}")
         from cellworld_game import save_video_output
         save_video_output(model=environment.model,
                           video_folder=videos_folder)
 
     if args.experiment_log:
-        experiment_log_file = config.experiments_folder()
+        experiment_log_file = run.experiments_folder()
         print(f"Saving experiment logs to {experiment_log_file}")
         from cellworld_game import save_log_output
         save_log_output(model=environment.model,
                         log_folder=experiment_log_file,
-                        experiment_name=config.experiments_name())
+                        experiment_name=run.experiments_name())
 
     scores = []
 
@@ -1,13 +1,11 @@
 import os
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 import typing
 import sys
 sys.path.append('../../')
 import json
 import argparse
-from env import create_vec_env, set_other_policy
 from algorightms import algorithms
-from callback import CellworldCallback
+from checkpoint import CheckpointWriter
 import config
 
 
@@ -15,9 +13,11 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description='Cellworld AI BotEvade training tool: trains an RL model on the Cellworld DualEvade OpenAI Gym environment')
     parser.add_argument('model_name', type=str, help='name of the model file in the models folder')
     parser.add_argument('-r', '--run_identifier', type=str, help='string identifying the run')
-    parser.add_argument('-b', '--replay_buffer_file', type=str, help='replay buffer file', required=False)
+    parser.add_argument('-mf', '--model_configs_folder', type=str, help='folder containing the model configuration file (default models/<task>)', required=False)
+    parser.add_argument('-b', '--replay_buffer_file', type=str, help='replay buffer file with demonstrations for both mice, sampled with the "demo_ratio" of the model configuration (default 0.25)', required=False)
     parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
     parser.add_argument('-o', '--other', action='store_true', help='include information about the other agent in observation')
+    parser.add_argument('-cc', '--concurrent', action='store_true', help='trains both mice at the same time in separate processes')
     args = parser.parse_args()
     return args
 
@@ -29,11 +29,12 @@ if __name__ == "__main__":
         print("Error:", e)
         exit(1)
 
-    config.set_task("dualevade")
-    config.set_model(args.model_name)
-    config.set_run_identifier(args.run_identifier)
+    run = config.RunContext(task_name="dualevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier,
+                            model_configs_folder=args.model_configs_folder)
 
-    model_configuration_file = config.model_config_file()
+    model_configuration_file = run.model_config_file()
 
     if not os.path.exists(model_configuration_file):
         print(f"Model configuration file '{model_configuration_file}' not found")
@@ -41,21 +42,29 @@ if __name__ == "__main__":
 
     replay_buffer_file = ""
     if args.replay_buffer_file:
-        replay_buffer_file = config.in_buffer_file(replay_buffer_file=replay_buffer_file)
+        replay_buffer_file = run.in_buffer_file(replay_buffer_file=args.replay_buffer_file)
         if not os.path.exists(replay_buffer_file):
             print(f"Replay buffer file '{replay_buffer_file}' not found")
             exit(1)
 
     model_config = json.loads(open(model_configuration_file).read())
+    from env import create_vec_env, set_other_policy
+    from callback import CellworldCallback
+    from replay_buffers import mix_demonstrations, save_memmap_buffer
 
-    run_replay_buffer_file_1 = config.out_buffer_file(suffix="mouse_1")
-    run_replay_buffer_file_2 = config.out_buffer_file(suffix="mouse_2")
+    if args.concurrent:
+        from selfplay import train_concurrent
+        train_concurrent(args, run, model_config)
+        exit(0)
 
-    run_data_file_1 = config.data_file(suffix="mouse_1")
-    run_data_file_2 = config.data_file(suffix="mouse_2")
+    run_replay_buffer_file_1 = run.out_buffer_file(suffix="mouse_1")
+    run_replay_buffer_file_2 = run.out_buffer_file(suffix="mouse_2")
 
-    logs_folder_1 = config.tensor_board_logs_folder(suffix="mouse_1")
-    logs_folder_2 = config.tensor_board_logs_folder(suffix="mouse_2")
+    run_data_file_1 = run.data_file(suffix="mouse_1")
+    run_data_file_2 = run.data_file(suffix="mouse_2")
+
+    logs_folder_1 = run.tensor_board_logs_folder(suffix="mouse_1")
+    logs_folder_2 = run.tensor_board_logs_folder(suffix="mouse_2")
 
     tlppo = True if args.tlppo else False
     other = True if args.other else False
@@ -64,13 +73,13 @@ if __name__ == "__main__":
                                 use_other=other,
                                 **model_config)
 
-    print("Mouse 1 envs created: ", len(vec_envs_1.envs))
+    print("Mouse 1 envs created: ", vec_envs_1.num_envs)
 
     vec_envs_2 = create_vec_env(use_lppos=tlppo,
                                 use_other=other,
                                 **model_config)
 
-    print("Mouse 2 envs created: ", len(vec_envs_2.envs))
+    print("Mouse 2 envs created: ", vec_envs_2.num_envs)
 
     algorithm = algorithms[model_config["algorithm"]]
 
@@ -78,7 +87,8 @@ if __name__ == "__main__":
         print(f"Data file '{run_data_file_1}' found, loading...")
         model_1 = algorithm.load(env=vec_envs_1,
                                  tensorboard_log=logs_folder_1,
-                                 path=run_data_file_1)
+                                 path=run_data_file_1,
+                                 replay_buffer=model_config.get("replay_buffer", "default"))
 
         reset_num_time_steps_1 = False
     else:
@@ -93,7 +103,8 @@ if __name__ == "__main__":
         print(f"Data file '{run_data_file_2}' found, loading...")
         model_2 = algorithm.load(env=vec_envs_2,
                                  tensorboard_log=logs_folder_2,
-                                 path=run_data_file_2)
+                                 path=run_data_file_2,
+                                 replay_buffer=model_config.get("replay_buffer", "default"))
 
         reset_num_time_steps_2 = False
     else:
@@ -104,15 +115,20 @@ if __name__ == "__main__":
 
         reset_num_time_steps_2 = True
 
-    set_other_policy(vec_env=vec_envs_1, model=model_2)
-    set_other_policy(vec_env=vec_envs_2, model=model_1)
+    if args.replay_buffer_file:
+        print(f"loading replay buffer file {replay_buffer_file}")
+        mix_demonstrations(model_1, replay_buffer_file, demo_ratio=model_config.get("demo_ratio", 0.25))
+        mix_demonstrations(model_2, replay_buffer_file, demo_ratio=model_config.get("demo_ratio", 0.25))
+
+    set_other_policy(vec_env=vec_envs_1, model=model_2, compile=model_config.get("compile_other_policy", False))
+    set_other_policy(vec_env=vec_envs_2, model=model_1, compile=model_config.get("compile_other_policy", False))
 
-    callback_1 = CellworldCallback()
-    callback_2 = CellworldCallback()
+    callback_1 = CellworldCallback(log_frequency=model_config.get("callback_log_frequency"))
+    callback_2 = CellworldCallback(log_frequency=model_config.get("callback_log_frequency"))
 
     performance_1: typing.List[float] = []
     best_survival_rate_1 = -0.1
-    performance_file_1 = config.performance_file(suffix="mouse_1")
+    performance_file_1 = run.performance_file(suffix="mouse_1")
 
     if os.path.exists(performance_file_1):
         with open(performance_file_1, 'r') as f:
@@ -123,7 +139,7 @@ if __name__ == "__main__":
 
     performance_2: typing.List[float] = []
     best_survival_rate_2 = -0.1
-    performance_file_2 = config.performance_file(suffix="mouse_2")
+    performance_file_2 = run.performance_file(suffix="mouse_2")
 
     if os.path.exists(performance_file_2):
         with open(performance_file_2, 'r') as f:
@@ -132,6 +148,8 @@ if __name__ == "__main__":
 
     cycle_offset_2 = len(performance_2)
 
+    checkpoints = CheckpointWriter()
+
     for cycle in range(model_config["training_cycles"]):
         model_1.learn(total_timesteps=model_config["training_steps"],
                       log_interval=model_config["log_interval"],
@@ -147,32 +165,35 @@ if __name__ == "__main__":
 
         reset_num_time_steps_2 = False
 
-        print(f"saving data file {run_data_file_1}")
-        model_1.save(run_data_file_1)
-        model_1.save(config.data_file(suffix="mouse_1", cycle=f"{cycle + cycle_offset_1:03}"))
-
+        data_file_aliases_1 = [run_data_file_1]
         if callback_1.current_survival > best_survival_rate_1:
             best_survival_rate_1 = callback_1.current_survival
-            model_1.save(config.data_file(suffix="mouse_1", cycle="best"))
+            data_file_aliases_1.append(run.data_file(suffix="mouse_1", cycle="best"))
+
+        print(f"saving data file {run_data_file_1}")
+        checkpoints.save(model_1, run.data_file(suffix="mouse_1", cycle=f"{cycle + cycle_offset_1:03}"), *data_file_aliases_1)
 
         performance_1.append(callback_1.current_survival)
         with open(performance_file_1, 'w') as f:
             json.dump(performance_1, f)
 
-        print(f"saving data file {run_data_file_2}")
-        model_2.save(run_data_file_2)
-        model_2.save(config.data_file(suffix="mouse_2", cycle=f"{cycle + cycle_offset_2:03}"))
-
+        data_file_aliases_2 = [run_data_file_2]
         if callback_2.current_survival > best_survival_rate_2:
             best_survival_rate_2 = callback_2.current_survival
-            model_2.save(config.data_file(suffix="mouse_2", cycle="best"))
+            data_file_aliases_2.append(run.data_file(suffix="mouse_2", cycle="best"))
+
+        print(f"saving data file {run_data_file_2}")
+        checkpoints.save(model_2, run.data_file(suffix="mouse_2", cycle=f"{cycle + cycle_offset_2:03}"), *data_file_aliases_2)
 
         performance_2.append(callback_2.current_survival)
         with open(performance_file_2, 'w') as f:
             json.dump(performance_2, f)
 
-    print(f"saving replay buffer file {run_replay_buffer_file_1}")
-    model_1.save_replay_buffer(run_replay_buffer_file_1)
-    print(f"saving replay buffer file {run_replay_buffer_file_2}")
-    model_2.save_replay_buffer(run_replay_buffer_file_2)
+    checkpoints.close()
+
+    if hasattr(model_1, "replay_buffer"):
+        print(f"saving replay buffer file {run_replay_buffer_file_1}")
+        save_memmap_buffer(model_1.replay_buffer, run_replay_buffer_file_1)
+        print(f"saving replay buffer file {run_replay_buffer_file_2}")
+        save_memmap_buffer(model_2.replay_buffer, run_replay_buffer_file_2)
 
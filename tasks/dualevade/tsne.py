@@ -1,15 +1,8 @@
-from sklearn.manifold import TSNE
-import matplotlib.pyplot as plt
-
-import numpy as np
-import pickle
 import os
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 import sys
 sys.path.append('../../')
 import json
 import argparse
-from env import create_vec_env, set_other_policy
 from algorightms import algorithms
 import config
 
@@ -21,15 +14,81 @@ def parse_arguments():
     parser.add_argument('-b', '--replay_buffer_file', type=str, help='replay buffer file', required=False)
     parser.add_argument('-t', '--tlppo', action='store_true', help='performs tlppo training')
     parser.add_argument('-o', '--other', action='store_true', help='include information about the other agent in observation')
+    parser.add_argument('-n', '--samples', type=int, default=100000, help='observations sampled from each replay buffer (default 100000)')
+    parser.add_argument('-bs', '--batch_size', type=int, default=4096, help='observations per feature extractor forward pass (default 4096)')
+    parser.add_argument('-pc', '--pca_components', type=int, default=50, help='PCA dimensions before t-SNE, 0 disables it (default 50)')
+    parser.add_argument('-fs', '--fit_samples', type=int, default=10000, help='points t-SNE is fitted on, the rest are projected with their nearest neighbors, 0 fits all (default 10000)')
+    parser.add_argument('-rc', '--recompute', action='store_true', help='recomputes the embeddings even if they were saved before')
     args = parser.parse_args()
     return args
 
 
-def get_features(algo, observation):
+def sample_observations(replay_buffer, sample_count: int, seed: int = 42):
+    """
+    Samples observations straight from the buffer arrays, without moving the whole sample to the model device.
+    """
+    import numpy as np
+    generator = np.random.default_rng(seed)
+    upper_bound = replay_buffer.buffer_size if replay_buffer.full else replay_buffer.pos
+    batch_indices = generator.integers(0, upper_bound, size=sample_count)
+    env_indices = generator.integers(0, replay_buffer.n_envs, size=sample_count)
+    return np.asarray(replay_buffer.observations[batch_indices, env_indices], dtype=np.float32)
+
+
+def get_features(algo, observations, batch_size: int = 4096):
+    """
+    Runs the observations through the q network features extractor batch_size rows at a time
+    into a preallocated float32 array.
+    """
+    import numpy as np
     import torch
+    features_extractor = algo.policy.q_net.features_extractor
+    features = None
     with torch.no_grad():
-        features = algo.policy.q_net.features_extractor(torch.tensor(observation, dtype=torch.float32))
-        return features.cpu().numpy()
+        for start in range(0, len(observations), batch_size):
+            batch = torch.as_tensor(observations[start:start + batch_size], dtype=torch.float32, device=algo.device)
+            batch_features = features_extractor(batch).cpu().numpy()
+            if features is None:
+                features = np.empty((len(observations), batch_features.shape[1]), dtype=np.float32)
+            features[start:start + len(batch_features)] = batch_features
+    return features
+
+
+def embed(data, pca_components: int = 50, fit_samples: int = 10000, seed: int = 42):
+    """
+    2D Barnes-Hut t-SNE embedding of data.
+
+    The data is first reduced to pca_components dimensions. When there are more than fit_samples points,
+    t-SNE is fitted on a random subset and the remaining points are placed at the distance weighted
+    average of the embeddings of their nearest fitted neighbors.
+    """
+    import numpy as np
+    from sklearn.decomposition import PCA
+    from sklearn.manifold import TSNE
+    from sklearn.neighbors import NearestNeighbors
+
+    data = np.asarray(data, dtype=np.float32)
+    if pca_components and data.shape[1] > pca_components:
+        data = PCA(n_components=pca_components, random_state=seed).fit_transform(data).astype(np.float32)
+
+    tsne = TSNE(n_components=2, method="barnes_hut", init="pca", random_state=seed)
+    if not fit_samples or len(data) <= fit_samples:
+        return tsne.fit_transform(data)
+
+    generator = np.random.default_rng(seed)
+    fit_indices = generator.choice(len(data), size=fit_samples, replace=False)
+    projected = np.ones(len(data), dtype=bool)
+    projected[fit_indices] = False
+
+    embedding = np.empty((len(data), 2), dtype=np.float32)
+    embedding[fit_indices] = tsne.fit_transform(data[fit_indices])
+
+    neighbors = NearestNeighbors(n_neighbors=5).fit(data[fit_indices])
+    distances, indices = neighbors.kneighbors(data[projected])
+    weights = 1.0 / (distances + 1e-8)
+    weights /= weights.sum(axis=1, keepdims=True)
+    embedding[projected] = (embedding[fit_indices][indices] * weights[:, :, None]).sum(axis=1)
+    return embedding
 
 
 if __name__ == "__main__":
@@ -39,11 +98,11 @@ if __name__ == "__main__":
         print("Error:", e)
         exit(1)
 
-    config.set_task("dualevade")
-    config.set_model(args.model_name)
-    config.set_run_identifier(args.run_identifier)
+    run = config.RunContext(task_name="dualevade",
+                            model_name=args.model_name,
+                            run_identifier=args.run_identifier)
 
-    model_configuration_file = config.model_config_file()
+    model_configuration_file = run.model_config_file()
 
     if not os.path.exists(model_configuration_file):
         print(f"Model configuration file '{model_configuration_file}' not found")
@@ -51,7 +110,7 @@ if __name__ == "__main__":
 
     replay_buffer_file = ""
     if args.replay_buffer_file:
-        replay_buffer_file = config.in_buffer_file(replay_buffer_file=replay_buffer_file)
+        replay_buffer_file = run.in_buffer_file(replay_buffer_file=args.replay_buffer_file)
         if not os.path.exists(replay_buffer_file):
             print(f"Replay buffer file '{replay_buffer_file}' not found")
             exit(1)
@@ -59,71 +118,103 @@ if __name__ == "__main__":
     model_config = json.loads(open(model_configuration_file).read())
     model_config["environment_count"] = 1
 
-    run_replay_buffer_file_1 = config.out_buffer_file(suffix="mouse_1")
-    with open(run_replay_buffer_file_1, 'rb') as f:
-        replay_buffer_1 = pickle.load(f)
-
-    sampled_obs_1 = replay_buffer_1.sample(100000)[0]
-
-    run_replay_buffer_file_2 = config.out_buffer_file(suffix="mouse_2")
-    with open(run_replay_buffer_file_2, 'rb') as f:
-        replay_buffer_2 = pickle.load(f)
-
-    sampled_obs_2 = replay_buffer_2.sample(100000)[0]
-
-    run_data_file_1 = config.data_file(suffix="mouse_1")
+    run_data_file_1 = run.data_file(suffix="mouse_1")
     if not os.path.exists(run_data_file_1):
         print(f"Data file '{run_data_file_1}' not found")
         exit(1)
 
-    run_data_file_2 = config.data_file(suffix="mouse_2")
+    run_data_file_2 = run.data_file(suffix="mouse_2")
     if not os.path.exists(run_data_file_2):
         print(f"Data file '{run_data_file_2}' not found")
         exit(1)
 
-    tlppo = True if args.tlppo else False
-    other = True if args.other else False
-
-    vec_envs_1 = create_vec_env(use_lppos=tlppo,
-                                use_other=other,
-                                **model_config)
-
-    print("Mouse 1 envs created: ", len(vec_envs_1.envs))
-
-    vec_envs_2 = create_vec_env(use_lppos=tlppo,
-                                use_other=other,
-                                **model_config)
-
-    print("Mouse 2 envs created: ", len(vec_envs_2.envs))
-
-    algorithm = algorithms[model_config["algorithm"]]
-
-
-    print(f"Data file '{run_data_file_1}' found, loading...")
-    model_1 = algorithm.load(env=vec_envs_1,
-                             path=run_data_file_1)
-
-    print(f"Data file '{run_data_file_2}' found, loading...")
-    model_2 = algorithm.load(env=vec_envs_2,
-                             path=run_data_file_2)
-
-    set_other_policy(vec_env=vec_envs_1, model=model_2)
-    set_other_policy(vec_env=vec_envs_2, model=model_1)
-
-    features1 = get_features(model_1, sampled_obs_1)
-    features2 = get_features(model_2, sampled_obs_2)
-
-    other_info_dimensions_1 = sampled_obs_1[:, 3:5].cpu()
-    other_info_dimensions_2 = sampled_obs_2[:, 3:5].cpu()
-
-    combined_data_1 = np.concatenate((other_info_dimensions_1, features1), axis=1)
-    combined_data_2 = np.concatenate((other_info_dimensions_2, features2), axis=1)
-
-    # Apply t-SNE
-    tsne = TSNE(n_components=2, random_state=42)
-
-    reduced_features_1 = tsne.fit_transform(combined_data_1)
-    reduced_features_2 = tsne.fit_transform(combined_data_2)
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    embedding_files = {mouse: os.path.join(run.data_folder(), f"tsne_mouse_{mouse}.npy") for mouse in (1, 2)}
+    other_info_files = {mouse: os.path.join(run.data_folder(), f"tsne_other_mouse_{mouse}.npy") for mouse in (1, 2)}
+
+    # the saved embeddings are reused only when they were computed with the same settings and models
+    parameters_file = os.path.join(run.data_folder(), "tsne_parameters.json")
+    parameters = {"samples": args.samples,
+                  "pca_components": args.pca_components,
+                  "fit_samples": args.fit_samples,
+                  "tlppo": args.tlppo,
+                  "other": args.other,
+                  "model_files": {run_data_file: [os.path.getmtime(run_data_file), os.path.getsize(run_data_file)]
+                                  for run_data_file in (run_data_file_1, run_data_file_2)}}
+    saved_parameters = None
+    if os.path.exists(parameters_file):
+        with open(parameters_file) as f:
+            saved_parameters = json.load(f)
+
+    if (args.recompute or
+            saved_parameters != parameters or
+            not all(os.path.exists(file) for file in list(embedding_files.values()) + list(other_info_files.values()))):
+        from env import create_vec_env, set_other_policy
+        from replay_buffers import open_replay_buffer
+
+        tlppo = True if args.tlppo else False
+        other = True if args.other else False
+
+        vec_envs_1 = create_vec_env(use_lppos=tlppo,
+                                    use_other=other,
+                                    **model_config)
+
+        print("Mouse 1 envs created: ", vec_envs_1.num_envs)
+
+        vec_envs_2 = create_vec_env(use_lppos=tlppo,
+                                    use_other=other,
+                                    **model_config)
+
+        print("Mouse 2 envs created: ", vec_envs_2.num_envs)
+
+        run_replay_buffer_file_1 = run.out_buffer_file(suffix="mouse_1")
+        replay_buffer_1 = open_replay_buffer(run_replay_buffer_file_1,
+                                             observation_space=vec_envs_1.observation_space,
+                                             action_space=vec_envs_1.action_space)
+
+        sampled_obs_1 = sample_observations(replay_buffer_1, args.samples, seed=1)
+
+        run_replay_buffer_file_2 = run.out_buffer_file(suffix="mouse_2")
+        replay_buffer_2 = open_replay_buffer(run_replay_buffer_file_2,
+                                             observation_space=vec_envs_2.observation_space,
+                                             action_space=vec_envs_2.action_space)
+
+        sampled_obs_2 = sample_observations(replay_buffer_2, args.samples, seed=2)
+
+        algorithm = algorithms[model_config["algorithm"]]
+
+        print(f"Data file '{run_data_file_1}' found, loading...")
+        model_1 = algorithm.load(env=vec_envs_1,
+                                 path=run_data_file_1)
+
+        print(f"Data file '{run_data_file_2}' found, loading...")
+        model_2 = algorithm.load(env=vec_envs_2,
+                                 path=run_data_file_2)
+
+        set_other_policy(vec_env=vec_envs_1, model=model_2)
+        set_other_policy(vec_env=vec_envs_2, model=model_1)
+
+        for mouse, model, sampled_obs in ((1, model_1, sampled_obs_1), (2, model_2, sampled_obs_2)):
+            features = get_features(model, sampled_obs, batch_size=args.batch_size)
+            other_info_dimensions = sampled_obs[:, 3:5]
+            combined_data = np.concatenate((other_info_dimensions, features), axis=1)
+            print(f"Embedding {len(combined_data)} mouse {mouse} observations...")
+            reduced_features = embed(combined_data,
+                                     pca_components=args.pca_components,
+                                     fit_samples=args.fit_samples)
+            np.save(embedding_files[mouse], reduced_features)
+            np.save(other_info_files[mouse], other_info_dimensions)
+            print(f"Embedding saved to {embedding_files[mouse]}")
+
+        with open(parameters_file, 'w') as f:
+            json.dump(parameters, f, indent=1)
+
+    reduced_features_1 = np.load(embedding_files[1])
+    reduced_features_2 = np.load(embedding_files[2])
+    other_info_dimensions_1 = np.load(other_info_files[1])
+    other_info_dimensions_2 = np.load(other_info_files[2])
 
     plt.figure(figsize=(30, 24))
     plt.scatter(reduced_features_1[:, 0], reduced_features_1[:, 1], c='blue', marker='o')
@@ -155,4 +246,3 @@ if __name__ == "__main__":
     # Show the plot
     plt.grid(True)
     plt.show()
-
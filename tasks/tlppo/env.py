@@ -1,25 +1,67 @@
+import os
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
 import cellworld_gym as cwg
 import cellworld_tlppo as ct
 import gymnasium
 
 
-def on_episode_end(env: ct.TlppoWrapper):
-    import matplotlib.pyplot as plt
-    lppo, adj_matrix = env.get_lppo()
-    plt.figure(figsize=(8, 8))
-    plt.scatter(lppo[:, 0], lppo[:, 1], color='blue', zorder=2)  # Plot nodes
+class LppoGraphRenderer:
+    """
+    on_episode_end callback that saves the LPPO graph as an image every interval episodes.
 
+    Only the get_lppo call runs on the env thread, the figure is drawn with a single LineCollection
+    and saved on a background thread. When the previous image is still being drawn the episode is
+    skipped, so rendering never blocks training.
 
-    for i in range(adj_matrix.shape[0]):
-        for j in range(adj_matrix.shape[1]):
-            if adj_matrix[i][j] == 1:
-                plt.plot([lppo[i][0], lppo[j][0]], [lppo[i][1], lppo[j][1]], color='black', zorder=1)
+    :param folder: folder for the images, rendering is disabled when None
+    :param interval: episodes between images, rendering is disabled when 0
+    """
+    def __init__(self, folder: typing.Optional[str] = None, interval: int = 0):
+        self.folder = folder
+        self.interval = interval
+        self.episode_count = 0
+        self.executor: typing.Optional[ThreadPoolExecutor] = None
+        self.pending: typing.Optional[Future] = None
 
-    plt.title('Graph Visualization')
-    plt.grid(True)
-    plt.show()
+    def __call__(self, env: ct.TlppoWrapper):
+        self.episode_count += 1
+        if not self.folder or not self.interval or self.episode_count % self.interval:
+            return
+        if self.pending is not None and not self.pending.done():
+            return
+        lppo, adj_matrix = env.get_lppo()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = self.executor.submit(self.save,
+                                            np.array(lppo),
+                                            np.array(adj_matrix),
+                                            os.path.join(self.folder, f"lppo_graph_{self.episode_count:06}.png"))
+
+    def __getstate__(self):
+        # the executor and the pending render stay in the process that created them
+        state = self.__dict__.copy()
+        state["executor"] = None
+        state["pending"] = None
+        return state
+
+    @staticmethod
+    def save(lppo: np.ndarray, adj_matrix: np.ndarray, file_name: str):
+        from matplotlib.figure import Figure
+        from matplotlib.collections import LineCollection
+        # pyplot keeps global state and is not safe off the main thread, draw on a standalone figure
+        figure = Figure(figsize=(8, 8))
+        axes = figure.add_subplot()
+        connected = adj_matrix == 1
+        sources, destinations = np.nonzero(np.triu(connected | connected.T))
+        segments = np.stack([lppo[sources, :2], lppo[destinations, :2]], axis=1)
+        axes.add_collection(LineCollection(segments, colors='black', zorder=1))
+        axes.scatter(lppo[:, 0], lppo[:, 1], color='blue', zorder=2)
+        axes.set_title('Graph Visualization')
+        axes.grid(True)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        figure.savefig(file_name)
 
 
 def create_env(world_name: str = "21_05",
@@ -30,21 +72,27 @@ def create_env(world_name: str = "21_05",
                reward_structure: dict = {},
                render: bool = False,
                real_time: bool = False,
+               share_world_assets: bool = False,
+               lppo_graph_folder: typing.Optional[str] = None,
+               lppo_graph_interval: int = 0,
                **kwargs):
 
-    return gymnasium.make("TlppoWrapper-v0",
-                          environment_name="CellworldBotEvade-v0",
-                          on_episode_end=on_episode_end,
-                          tlppo_dim=np.array([True, True, False, False, False, False, False, False, False, False, False]),
-                          tlppo_count=100,
-                          world_name=world_name,
-                          use_lppos=use_lppos,
-                          use_predator=use_predator,
-                          max_step=max_steps,
-                          time_step=time_step,
-                          reward_function=cwg.Reward(reward_structure),
-                          real_time=real_time,
-                          render=render)
+    import world_cache
+    with world_cache.shared_world_assets(share_world_assets):
+        return gymnasium.make("TlppoWrapper-v0",
+                              environment_name="CellworldBotEvade-v0",
+                              on_episode_end=LppoGraphRenderer(folder=lppo_graph_folder,
+                                                               interval=lppo_graph_interval),
+                              tlppo_dim=np.array([True, True, False, False, False, False, False, False, False, False, False]),
+                              tlppo_count=100,
+                              world_name=world_name,
+                              use_lppos=use_lppos,
+                              use_predator=use_predator,
+                              max_step=max_steps,
+                              time_step=time_step,
+                              reward_function=cwg.Reward(reward_structure),
+                              real_time=real_time,
+                              render=render)
 
 
 def create_vec_env(environment_count: int,
@@ -54,13 +102,24 @@ def create_vec_env(environment_count: int,
                    max_steps: int = 300,
                    time_step: float = .25,
                    reward_structure: dict = {},
+                   vec_env_backend: str = "dummy",
+                   share_world_assets: bool = False,
+                   lppo_graph_folder: typing.Optional[str] = None,
+                   lppo_graph_interval: int = 0,
                    **kwargs):
 
-    return DummyVecEnv([lambda:
-                        create_env(world_name=world_name,
-                                   use_lppos=use_lppos,
-                                   use_predator=use_predator,
-                                   max_steps=max_steps,
-                                   time_step=time_step,
-                                   reward_structure=reward_structure)
-                        for _ in range(environment_count)])
+    # the lppo graph is the same for every env, only the first one renders it
+    env_fns = [lambda env_index=env_index:
+               create_env(world_name=world_name,
+                          use_lppos=use_lppos,
+                          use_predator=use_predator,
+                          max_steps=max_steps,
+                          time_step=time_step,
+                          reward_structure=reward_structure,
+                          share_world_assets=share_world_assets,
+                          lppo_graph_folder=lppo_graph_folder,
+                          lppo_graph_interval=lppo_graph_interval if env_index == 0 else 0)
+               for env_index in range(environment_count)]
+
+    import vec_env_backends
+    return vec_env_backends.create_vec_env(env_fns, vec_env_backend=vec_env_backend)
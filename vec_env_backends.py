@@ -0,0 +1,160 @@
+import ctypes
+import multiprocessing as mp
+import typing
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper, VecEnv, VecEnvObs, VecEnvStepReturn
+from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv
+
+
+def _shared_array(ctx, shape: typing.Tuple[int, ...], dtype: np.dtype):
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return ctx.RawArray(ctypes.c_byte, max(nbytes, 1))
+
+
+def _as_array(raw, shape: typing.Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _shm_worker(remote,
+                parent_remote,
+                env_fn_wrapper: CloudpickleWrapper,
+                env_index: int,
+                buffers: typing.Dict[str, typing.Tuple[typing.Any, typing.Tuple[int, ...], np.dtype]]) -> None:
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    env = _patch_env(env_fn_wrapper.var())
+    arrays = {name: _as_array(raw, shape, dtype) for name, (raw, shape, dtype) in buffers.items()}
+    observations = arrays["observations"]
+    actions = arrays["actions"]
+    rewards = arrays["rewards"]
+    dones = arrays["dones"]
+    reset_info = {}
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                action = actions[env_index]
+                if action.ndim == 0:
+                    action = action.item()
+                observation, reward, terminated, truncated, info = env.step(action)
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                if done:
+                    info["terminal_observation"] = observation
+                    observation, reset_info = env.reset()
+                observations[env_index] = observation
+                rewards[env_index] = reward
+                dones[env_index] = done
+                remote.send((info, reset_info))
+            elif cmd == "reset":
+                maybe_options = {"options": data[1]} if data[1] else {}
+                observation, reset_info = env.reset(seed=data[0], **maybe_options)
+                observations[env_index] = observation
+                remote.send(reset_info)
+            elif cmd == "render":
+                remote.send(env.render())
+            elif cmd == "close":
+                env.close()
+                remote.close()
+                break
+            elif cmd == "env_method":
+                method = env.get_wrapper_attr(data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(env.get_wrapper_attr(data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+
+class ShmVecEnv(SubprocVecEnv):
+    """
+    Multiprocess vectorized environment that exchanges observations, actions, rewards and dones
+    through preallocated shared memory instead of pickling them on every step.
+    Only the (small) info dictionaries travel through the pipes.
+
+    :param env_fns: Environments to run in subprocesses
+    :param start_method: method used to start the subprocesses (see SubprocVecEnv)
+    """
+    def __init__(self,
+                 env_fns: typing.List[typing.Callable[[], typing.Any]],
+                 start_method: typing.Optional[str] = None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        # spaces are needed to size the shared arrays before the workers start
+        probe_env = _patch_env(env_fns[0]())
+        observation_space, action_space = probe_env.observation_space, probe_env.action_space
+        probe_env.close()
+        if not isinstance(observation_space, spaces.Box):
+            raise ValueError(f"ShmVecEnv only supports Box observation spaces, got {observation_space}")
+
+        if start_method is None:
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+
+        layout = {"observations": ((n_envs,) + observation_space.shape, observation_space.dtype),
+                  "actions": ((n_envs,) + action_space.shape, action_space.dtype),
+                  "rewards": ((n_envs,), np.dtype(np.float32)),
+                  "dones": ((n_envs,), np.dtype(bool))}
+        buffers = {name: (_shared_array(ctx, shape, dtype), shape, np.dtype(dtype)) for name, (shape, dtype) in layout.items()}
+        arrays = {name: _as_array(raw, shape, dtype) for name, (raw, shape, dtype) in buffers.items()}
+        self._observations = arrays["observations"]
+        self._actions = arrays["actions"]
+        self._rewards = arrays["rewards"]
+        self._dones = arrays["dones"]
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for env_index, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), env_index, buffers)
+            process = ctx.Process(target=_shm_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions[:] = np.asarray(actions).reshape(self._actions.shape)
+        for remote in self.remotes:
+            remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self) -> VecEnvStepReturn:
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        infos, reset_infos = zip(*results)
+        self.reset_infos = list(reset_infos)
+        return np.copy(self._observations), np.copy(self._rewards), np.copy(self._dones), list(infos)
+
+    def reset(self) -> VecEnvObs:
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send(("reset", (self._seeds[env_idx], self._options[env_idx])))
+        self.reset_infos = [remote.recv() for remote in self.remotes]
+        self._reset_seeds()
+        self._reset_options()
+        return np.copy(self._observations)
+
+
+vec_env_backends = {"dummy": DummyVecEnv,
+                    "subproc": SubprocVecEnv,
+                    "shm": ShmVecEnv}
+
+
+def create_vec_env(env_fns: typing.List[typing.Callable[[], typing.Any]],
+                   vec_env_backend: str = "dummy") -> VecEnv:
+    if vec_env_backend not in vec_env_backends:
+        raise ValueError(f"Unknown vec_env_backend '{vec_env_backend}', expected one of {list(vec_env_backends)}")
+    return vec_env_backends[vec_env_backend](env_fns)
@@ -0,0 +1,77 @@
+import typing
+import threading
+import contextlib
+
+loaders: typing.Dict[str, typing.Any] = {}
+loaders_lock = threading.Lock()
+patch_lock = threading.Lock()
+patch_depth = 0
+original_init: typing.Any = None
+
+
+@contextlib.contextmanager
+def shared_world_assets(enabled: bool = True):
+    """
+    While the context is open, the cellworld_game.CellWorldLoader instances of a world_name share one loader state.
+
+    Every env (and the game model inside it) builds its own loader, parsing the world, occlusions,
+    spawn locations and LPPOs and computing the paths between every pair of cells. Envs built inside
+    the context reuse the loader of the first env of their world in this process; loaders built
+    outside the context are unaffected, and CellWorldLoader is restored when the outermost context exits.
+
+    The shared loader is not immutable: navigation fills a path memo lazily, so envs of the same
+    world, including the envs OtherPolicyVecEnv steps on concurrent threads, write to the same memo.
+    Every env stores the same path for a given pair of cells and a dict item assignment is atomic
+    under the GIL, so concurrent fills only duplicate work. Do not build envs that modify the loader
+    (e.g. change occlusions after construction) with shared assets.
+
+    :param enabled: when False the context does nothing, so env factories can always enter it
+    """
+    if not enabled:
+        yield
+        return
+    _patch_loader()
+    try:
+        yield
+    finally:
+        _restore_loader()
+
+
+def _patch_loader() -> None:
+    global patch_depth, original_init
+    import cellworld_game
+    loader_class = cellworld_game.CellWorldLoader
+    with patch_lock:
+        patch_depth += 1
+        if patch_depth > 1:
+            return
+        original_init = loader_class.__dict__.get("__init__")
+        load = loader_class.__init__
+
+        def shared_init(self, world_name: str):
+            # the loaders of a world share the attribute dict of its first loader, replacing
+            # __new__ instead would leave the class unable to construct loaders once restored
+            with loaders_lock:
+                loader = loaders.get(world_name)
+                if loader is None:
+                    load(self, world_name=world_name)
+                    loaders[world_name] = self
+                    return
+            self.__dict__ = loader.__dict__
+
+        loader_class.__init__ = shared_init
+
+
+def _restore_loader() -> None:
+    global patch_depth, original_init
+    import cellworld_game
+    loader_class = cellworld_game.CellWorldLoader
+    with patch_lock:
+        patch_depth -= 1
+        if patch_depth > 0:
+            return
+        if original_init is None:
+            del loader_class.__init__
+        else:
+            loader_class.__init__ = original_init
+        original_init = None